@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from app import catalog, ddl
+from app.db import checkout, connection
+
+# Index advisor: crud reports which columns each list query filtered and
+# sorted on, with its latency. Usage is aggregated in memory, flushed to
+# internal.column_usage in the background, and turned into B-tree index
+# proposals for frequently used, slow columns that have no index yet.
+
+FLUSH_INTERVAL = float(os.environ.get('ADVISOR_FLUSH_INTERVAL', 60))
+MIN_CALLS = int(os.environ.get('ADVISOR_MIN_CALLS', 50))
+MIN_AVG_MS = float(os.environ.get('ADVISOR_MIN_AVG_MS', 5))
+
+_pending = {}  # (table, column, usage) -> [calls, total_ms]
+_lock = threading.Lock()
+_flusher = None
+
+
+def record_usage(table_name, filter_columns, sort_column, duration):
+    """Records one list query's filter/sort columns and latency in seconds."""
+    ms = duration * 1000
+    keys = [(table_name, c, 'filter') for c in filter_columns]
+    if sort_column:
+        keys.append((table_name, sort_column, 'sort'))
+    if not keys:
+        return
+
+    with _lock:
+        for key in keys:
+            entry = _pending.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+    _start_flusher()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name="advisor-flush", daemon=True)
+            _flusher.start()
+
+
+def _reset_after_fork():
+    # Usage not yet flushed by the parent belongs to the parent.
+    global _pending, _lock, _flusher
+    _pending = {}
+    _lock = threading.Lock()
+    _flusher = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Warning: Index advisor flush failed: {e}")
+
+
+def flush():
+    """Writes aggregated usage to internal.column_usage."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+
+    rows = [(t, c, u, calls, total_ms) for (t, c, u), (calls, total_ms) in pending.items()]
+    with checkout() as conn:
+        cur = conn.cursor()
+        execute_values(cur, """
+            INSERT INTO internal.column_usage (table_name, column_name, usage, calls, total_ms)
+            VALUES %s
+            ON CONFLICT (table_name, column_name, usage) DO UPDATE
+            SET calls = column_usage.calls + EXCLUDED.calls,
+                total_ms = column_usage.total_ms + EXCLUDED.total_ms,
+                last_seen = CURRENT_TIMESTAMP
+        """, rows)
+        conn.commit()
+        cur.close()
+
+
+def get_indexes(table_name):
+    """Existing indexes on an app table with their leading column."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT i.relname, pg_get_indexdef(i.oid), a.attname, x.indisprimary
+            FROM pg_index x
+            JOIN pg_class t ON t.oid = x.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            JOIN pg_class i ON i.oid = x.indexrelid
+            LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = x.indkey[0]
+            WHERE n.nspname = 'app' AND t.relname = %s
+            ORDER BY i.relname;
+        """, (table_name,))
+        rows = cur.fetchall()
+        cur.close()
+    return [{
+        "name": name,
+        "definition": definition,
+        "leading_column": leading,
+        "primary": primary,
+        "managed": name.startswith(ddl.MANAGED_INDEX_PREFIX),
+    } for name, definition, leading, primary in rows]
+
+
+def get_index_advice(table_name):
+    """Existing indexes, recorded column usage and proposed B-tree indexes."""
+    if catalog.get_columns(table_name) is None:
+        raise ValueError("Table does not exist")
+    flush()
+
+    indexes = get_indexes(table_name)
+    indexed = {ix["leading_column"] for ix in indexes}
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT column_name, usage, calls, total_ms / GREATEST(calls, 1)
+            FROM internal.column_usage
+            WHERE table_name = %s
+            ORDER BY total_ms DESC;
+        """, (table_name,))
+        usage = [{"column": c, "usage": u, "calls": calls, "avg_ms": round(avg, 3)}
+                 for c, u, calls, avg in cur.fetchall()]
+        cur.close()
+
+    proposals = []
+    proposed = set()
+    for entry in usage:
+        column = entry["column"]
+        if column in indexed or column in proposed:
+            continue
+        if entry["calls"] < MIN_CALLS or entry["avg_ms"] < MIN_AVG_MS:
+            continue
+        proposed.add(column)
+        proposals.append(dict(entry, sql=index_sql(table_name, [column])))
+
+    return {"indexes": indexes, "usage": usage, "proposals": proposals}
+
+
+def _index_name(table_name, columns):
+    # Postgres truncates identifiers to 63 bytes.
+    return f'{ddl.MANAGED_INDEX_PREFIX}{table_name}_{"_".join(columns)}'[:63]
+
+
+def index_sql(table_name, columns):
+    col_str = ", ".join([f'"{c}"' for c in columns])
+    return (f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{_index_name(table_name, columns)}" '
+            f'ON app."{table_name}" USING btree ({col_str})')
+
+
+def create_index(table_name, columns):
+    """Builds a managed B-tree index on existing columns of an app table."""
+    details = catalog.get_columns(table_name)
+    if details is None:
+        raise ValueError("Table does not exist")
+    col_names = {c['name'] for c in details}
+    if not columns or any(c not in col_names for c in columns):
+        raise ValueError("Index columns must be existing columns of the table")
+    if catalog.partition_column(table_name):
+        raise ValueError("Indexes cannot be built concurrently on partitioned objects")
+
+    ddl.execute_index_ddl(index_sql(table_name, columns))
+    return _index_name(table_name, columns)
+
+
+def drop_index(table_name, index_name):
+    """Drops a managed index belonging to an app table."""
+    if not any(ix["name"] == index_name and ix["managed"] for ix in get_indexes(table_name)):
+        raise ValueError("Managed index not found on this table")
+    ddl.execute_index_ddl(f'DROP INDEX CONCURRENTLY IF EXISTS app."{index_name}"')
@@ -0,0 +1,244 @@
+import os
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app import advisor, audit, catalog, crud, db, introspection, serialize
+
+# Async variant of the /api/objects JSON API for clients that keep many
+# mostly idle connections open. It runs on an ASGI server with psycopg 3's
+# async pool, so a waiting request holds no thread and no connection.
+# Statements and validation come from crud's build_* helpers, so both APIs
+# accept and reject exactly the same input and return the same JSON.
+#
+#   uvicorn app.asgi:app --host 0.0.0.0 --port 8000
+#
+# The schema catalog and audit writer still use the psycopg2 pool in app.db
+# (a catalog reload runs in a worker thread, never on the event loop).
+# Queuing audit events can block on a full queue, so it runs in a worker
+# thread too.
+
+ASYNC_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', 2))
+ASYNC_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', 20))
+ASYNC_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+
+_pool = None
+
+
+class _JSONResponse(JSONResponse):
+    # Same encoding as the Flask API (see main.RecordJSONProvider).
+    def render(self, content):
+        return serialize.dumps(content)
+
+
+def _error(message, status=400):
+    return _JSONResponse({"error": message}, status_code=status)
+
+
+def _fields_arg(request):
+    fields = [f.strip() for f in request.query_params.get('fields', '').split(',') if f.strip()]
+    return list(dict.fromkeys(fields)) or None
+
+
+async def _catalog_ready():
+    # Catalog hits are in-memory; only a reload needs the (blocking) database.
+    if not catalog.is_loaded():
+        await run_in_threadpool(catalog.get_tables)
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def _fetch(sql, params, rows='one'):
+    """Runs one statement and returns (row or rows, column names)."""
+    async with _pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            if rows == 'all':
+                result = await cur.fetchall()
+            else:
+                result = await cur.fetchone()
+            names = [d.name for d in cur.description] if cur.description else []
+    return result, names
+
+
+def _as_dict(names, row):
+    return dict(zip(names, row)) if row is not None else None
+
+
+async def list_objects(request):
+    await _catalog_ready()
+    return _JSONResponse(introspection.get_tables())
+
+
+async def object_details(request):
+    await _catalog_ready()
+    return _JSONResponse(introspection.get_table_details(request.path_params['table']))
+
+
+async def list_records(request):
+    table = request.path_params['table']
+    args = request.query_params
+    try:
+        await _catalog_ready()
+        limit = args.get('limit')
+        query, params, count_query, count_params, page = crud.build_page_query(
+            table,
+            filters={k[2:]: v for k, v in args.items() if k.startswith('f_')},
+            sort_by=args.get('sort'),
+            order=args.get('order', 'ASC'),
+            limit=int(limit) if limit else None,
+            after=args.get('after'),
+            fields=_fields_arg(request))
+
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                started = time.perf_counter()
+                await cur.execute(query, params)
+                rows = await cur.fetchall()
+                advisor.record_usage(table, page["filter_columns"], page["sort_by"],
+                                     time.perf_counter() - started)
+                total = None
+                if args.get('count') == 'estimate':
+                    await cur.execute("EXPLAIN (FORMAT JSON) " + count_query, count_params)
+                    total = crud.plan_rows((await cur.fetchone())[0])
+
+        rows, next_cursor = crud.finish_page(rows, page)
+        # Same shape as the Flask API: a list of rows, paging metadata in headers.
+        if args.get('shape') == 'objects':
+            response = _JSONResponse([dict(zip(page['columns'], row)) for row in rows])
+        else:
+            response = _JSONResponse(rows)
+        if next_cursor:
+            next_args = dict(args)
+            next_args['after'] = next_cursor
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{request.url.path}?{urlencode(next_args)}>; rel="next"'
+        if total is not None:
+            response.headers['X-Total-Estimate'] = str(total)
+        return response
+    except Exception as e:
+        return _error(str(e))
+
+
+async def get_record(request):
+    try:
+        await _catalog_ready()
+        sql, params = crud.build_get(request.path_params['table'], request.path_params['id'],
+                                     _fields_arg(request))
+        row, names = await _fetch(sql, params)
+        if row is None:
+            return _error("Record not found", 404)
+        return _JSONResponse(_as_dict(names, row))
+    except Exception as e:
+        return _error(str(e))
+
+
+async def create_record(request):
+    table = request.path_params['table']
+    try:
+        await _catalog_ready()
+        data = await _json_body(request)
+        if not isinstance(data, dict):
+            raise ValueError("No valid data provided")
+        sql, values, pk_col = crud.build_insert(table, data)
+        row, names = await _fetch(sql, values)
+        record = _as_dict(names, row)
+        await run_in_threadpool(audit.record_changes, table, pk_col, 'insert', [record])
+        return _JSONResponse({"status": "success", "record": record}, status_code=201)
+    except Exception as e:
+        return _error(str(e))
+
+
+async def update_record(request):
+    table = request.path_params['table']
+    try:
+        await _catalog_ready()
+        data = await _json_body(request)
+        if not isinstance(data, dict):
+            raise ValueError("No valid data provided")
+        sql, values, pk_col, changes = crud.build_update(table, request.path_params['id'], data)
+        row, names = await _fetch(sql, values)
+        record = _as_dict(names, row)
+        if record is None:
+            return _error("Record not found", 404)
+        if changes:
+            await run_in_threadpool(audit.record_changes, table, pk_col, 'update', [record])
+        return _JSONResponse({"status": "success", "record": record})
+    except Exception as e:
+        return _error(str(e))
+
+
+async def delete_record(request):
+    table = request.path_params['table']
+    try:
+        await _catalog_ready()
+        sql, params, pk_col = crud.build_delete(table, request.path_params['id'])
+        row, names = await _fetch(sql, params)
+        if row is not None:
+            await run_in_threadpool(audit.record_changes, table, pk_col, 'delete', [_as_dict(names, row)])
+        return _JSONResponse({"status": "success"})
+    except Exception as e:
+        return _error(str(e))
+
+
+async def duplicate_record(request):
+    table = request.path_params['table']
+    try:
+        await _catalog_ready()
+        count = request.query_params.get('count') or ((await _json_body(request)) or {}).get('count', 1)
+        sql, params, pk_col = crud.build_duplicate(table, request.path_params['id'], count)
+        rows, names = await _fetch(sql, params, rows='all')
+        if not rows:
+            raise ValueError("Original record not found")
+        records = [_as_dict(names, row) for row in rows]
+        await run_in_threadpool(audit.record_changes, table, pk_col, 'insert', records)
+        return _JSONResponse({"status": "success", "records": records})
+    except Exception as e:
+        return _error(str(e))
+
+
+async def health(request):
+    return _JSONResponse({"status": "healthy", "pool": _pool.get_stats()})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pool
+    # Every handler runs a single statement, so autocommit is atomic enough
+    # and no connection is ever returned with an open transaction.
+    _pool = AsyncConnectionPool(kwargs=dict(db.connect_params(), autocommit=True), min_size=ASYNC_POOL_MIN,
+                                max_size=ASYNC_POOL_MAX, timeout=ASYNC_POOL_TIMEOUT, open=False)
+    await _pool.open()
+    try:
+        await run_in_threadpool(catalog.get_tables)
+    except Exception as e:
+        print(f"Warning: Schema catalog warm-up failed: {e}")
+    try:
+        yield
+    finally:
+        await _pool.close()
+        await run_in_threadpool(audit.flush)
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/api/objects', list_objects, methods=['GET']),
+    Route('/api/objects/{table}', object_details, methods=['GET']),
+    Route('/api/objects/{table}/records', list_records, methods=['GET']),
+    Route('/api/objects/{table}/records', create_record, methods=['POST']),
+    Route('/api/objects/{table}/records/{id}', get_record, methods=['GET']),
+    Route('/api/objects/{table}/records/{id}', update_record, methods=['PUT']),
+    Route('/api/objects/{table}/records/{id}', delete_record, methods=['DELETE']),
+    Route('/api/objects/{table}/records/{id}/duplicate', duplicate_record, methods=['POST']),
+    Route('/health', health, methods=['GET']),
+])
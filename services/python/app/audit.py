@@ -0,0 +1,195 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from app import catalog, metrics
+from app.db import after_commit, checkout, connection
+
+# Buffered audit writer. DDL attempts and record changes are queued and a
+# background thread writes them in batches (multi-row INSERTs) once
+# AUDIT_BATCH_SIZE events are waiting or AUDIT_FLUSH_INTERVAL has passed.
+# A full queue blocks producers for up to AUDIT_PUT_TIMEOUT seconds per call
+# (backpressure, shared by all events of a batch) before events are dropped
+# and counted.
+
+QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0))
+PUT_TIMEOUT = float(os.environ.get('AUDIT_PUT_TIMEOUT', 1.0))
+RECORD_HISTORY = os.environ.get('AUDIT_RECORD_HISTORY', '1') != '0'
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_thread = None
+_lock = threading.Lock()
+_STOP = object()
+
+metrics.describe('homeserver_audit_events_total', 'counter', 'Audit events by kind and outcome.')
+
+
+class _FlushMarker:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def _ensure_writer():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_writer_loop, name="audit-writer", daemon=True)
+            _thread.start()
+
+
+def _reset_after_fork():
+    # Events queued in the parent are written by the parent.
+    global _queue, _thread, _lock
+    _queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _thread = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _put(events):
+    """
+    Queues `events`, waiting at most PUT_TIMEOUT seconds in total for queue
+    space; once that is used up the rest are only queued if space is free.
+    """
+    _ensure_writer()
+    deadline = time.monotonic() + PUT_TIMEOUT
+    dropped = {}
+    for event in events:
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                _queue.put(event, timeout=remaining)
+            else:
+                _queue.put_nowait(event)
+        except queue.Full:
+            dropped[event[0]] = dropped.get(event[0], 0) + 1
+    for kind, count in dropped.items():
+        metrics.inc('homeserver_audit_events_total', count, kind=kind, outcome='dropped')
+    if dropped:
+        print(f"Warning: Audit queue full, dropped {sum(dropped.values())} of {len(events)} events")
+
+
+def record_ddl(sql, success, error_msg=None):
+    """Queues a DDL audit row."""
+    _put([('ddl', (sql, success, error_msg))])
+
+
+def record_changes(table_name, pk_col, operation, records):
+    """
+    Queues record-history rows for rows written by crud. Inside a request
+    they are only queued once the request's transaction has committed.
+    """
+    if not RECORD_HISTORY or not records:
+        return
+    events = [('record', (table_name, None if pk_col is None else str(r.get(pk_col)), operation,
+                          json.dumps(r, default=str)))
+              for r in records]
+
+    after_commit(lambda: _put(events))
+
+
+def _write(batch):
+    ddl_rows = [payload for kind, payload in batch if kind == 'ddl']
+    record_rows = [payload for kind, payload in batch if kind == 'record']
+    with checkout() as conn:
+        cur = conn.cursor()
+        if ddl_rows:
+            execute_values(cur, "INSERT INTO internal.ddl_audit (sql_text, success, error_message) VALUES %s",
+                           ddl_rows)
+        if record_rows:
+            execute_values(cur, """
+                INSERT INTO internal.record_history (table_name, record_pk, operation, data)
+                VALUES %s
+            """, record_rows, template="(%s, %s, %s, %s::jsonb)", page_size=BATCH_SIZE)
+        conn.commit()
+        cur.close()
+    for kind, count in (('ddl', len(ddl_rows)), ('record', len(record_rows))):
+        if count:
+            metrics.inc('homeserver_audit_events_total', count, kind=kind, outcome='written')
+
+
+def _writer_loop():
+    batch = []
+    markers = []
+    deadline = time.monotonic() + FLUSH_INTERVAL
+    stop = False
+    while not stop:
+        try:
+            item = _queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, _FlushMarker):
+                markers.append(item)
+            else:
+                batch.append(item)
+        except queue.Empty:
+            pass
+
+        if batch and (stop or markers or len(batch) >= BATCH_SIZE or time.monotonic() >= deadline):
+            try:
+                _write(batch)
+            except Exception as e:
+                metrics.inc('homeserver_audit_events_total', len(batch), kind='batch', outcome='failed')
+                print(f"Warning: Failed to write {len(batch)} audit events: {e}")
+            batch = []
+        if time.monotonic() >= deadline or not batch:
+            deadline = time.monotonic() + FLUSH_INTERVAL
+        for marker in markers:
+            marker.done.set()
+        markers = []
+
+
+def flush(timeout=5.0):
+    """Blocks until everything queued so far has been written."""
+    if _thread is None or not _thread.is_alive():
+        return
+    marker = _FlushMarker()
+    try:
+        _queue.put(marker, timeout=timeout)
+    except queue.Full:
+        return
+    marker.done.wait(timeout)
+
+
+@atexit.register
+def shutdown(timeout=5.0):
+    """Writes out queued events and stops the writer thread."""
+    if _thread is None or not _thread.is_alive():
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    _thread.join(timeout)
+
+
+def get_history(table_name, record_pk, limit=100):
+    """Change log of one record, newest first."""
+    if catalog.get_columns(table_name) is None:
+        raise ValueError("Table does not exist")
+    limit = max(1, min(int(limit), 1000))
+    flush()
+    with connection(primary=True) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, operation, data, changed_at
+            FROM internal.record_history
+            WHERE table_name = %s AND record_pk = %s
+            ORDER BY id DESC
+            LIMIT %s
+        """, (table_name, str(record_pk), limit))
+        rows = cur.fetchall()
+        cur.close()
+    return [{"id": i, "operation": op, "data": data, "changed_at": changed_at}
+            for i, op, data, changed_at in rows]
@@ -0,0 +1,290 @@
+import os
+import threading
+import time
+
+from app.db import connection
+from app import notify
+
+SCHEMA_CHANNEL = 'schema_changed'
+
+# Generated tsvector column maintained by ddl.install_search. It is hidden
+# from the column lists; has_search() reports whether a table has one.
+SEARCH_COLUMN = '_search'
+TEXT_TYPES = ('text', 'character varying', 'character')
+NUMERIC_TYPES = ('smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision')
+TEMPORAL_TYPES = ('date', 'timestamp without time zone', 'timestamp with time zone')
+
+# In-process cache of the 'app' schema: {table_name: [column dicts]}.
+# Loaded with a single pg_catalog query and dropped whenever the schema
+# changes, either through ddl.execute_ddl or a NOTIFY from another worker.
+# Materialized views (derived objects, see app.derived) are included; their
+# unique key column stands in for the primary key. Partitioned tables (see
+# app.partitions) appear once, as their parent: the partition column is part
+# of the primary key there but is not reported as a key column.
+_tables = None
+_searchable = frozenset()
+_derived = frozenset()
+_partition_columns = {}
+_loaded_at = 0.0
+_generation = 0
+_lock = threading.Lock()
+_listening = False
+
+# The column type is reported like information_schema.columns.data_type
+# (the API's format before the catalog existed): arrays as 'ARRAY', types
+# outside pg_catalog as 'USER-DEFINED' and domains as their base type.
+# sql_type is the full type with its modifier (e.g. character(3)), for casts.
+CATALOG_QUERY = """
+    SELECT c.relname,
+           a.attname,
+           CASE WHEN t.typtype = 'd' THEN
+                    CASE WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                         WHEN nbt.nspname = 'pg_catalog' THEN format_type(t.typbasetype, NULL)
+                         ELSE 'USER-DEFINED' END
+                WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+                WHEN nt.nspname = 'pg_catalog' THEN format_type(a.atttypid, NULL)
+                ELSE 'USER-DEFINED' END,
+           format_type(a.atttypid, a.atttypmod),
+           NOT a.attnotnull,
+           pg_get_expr(d.adbin, d.adrelid),
+           COALESCE(a.attnum = ANY(i.indkey) AND NOT COALESCE(a.attnum = ANY(pt.partattrs), FALSE), FALSE),
+           c.relkind = 'm',
+           COALESCE(a.attnum = ANY(pt.partattrs), FALSE)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attribute a
+      ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    LEFT JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_namespace nt ON nt.oid = t.typnamespace
+    LEFT JOIN pg_type bt ON t.typtype = 'd' AND bt.oid = t.typbasetype
+    LEFT JOIN pg_namespace nbt ON nbt.oid = bt.typnamespace
+    LEFT JOIN LATERAL (
+        SELECT x.indkey FROM pg_index x
+        WHERE x.indrelid = c.oid AND (x.indisprimary OR (c.relkind = 'm' AND x.indisunique AND x.indnatts = 1))
+        ORDER BY x.indisprimary DESC, x.indexrelid
+        LIMIT 1
+    ) i ON TRUE
+    LEFT JOIN pg_partitioned_table pt ON pt.partrelid = c.oid
+    WHERE n.nspname = 'app'
+    AND c.relkind IN ('r', 'p', 'm')
+    AND NOT c.relispartition
+    ORDER BY c.relname, a.attnum;
+"""
+
+
+# Size and activity statistics per object, summed over the partitions of
+# partitioned tables. Row counts are the planner's estimates (reltuples, or
+# the live-tuple counter before the first ANALYZE), so no table is scanned.
+STATS_QUERY = """
+    SELECT c.relname,
+           sum(CASE WHEN r.reltuples >= 0 THEN r.reltuples ELSE COALESCE(s.n_live_tup, 0) END)::bigint,
+           sum(pg_table_size(t.relid))::bigint,
+           sum(pg_indexes_size(t.relid))::bigint,
+           max(GREATEST(s.last_vacuum, s.last_autovacuum)),
+           max(GREATEST(s.last_analyze, s.last_autoanalyze)),
+           sum(COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0))::bigint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL (
+        SELECT c.oid AS relid WHERE c.relkind <> 'p'
+        UNION ALL
+        SELECT p.relid FROM pg_partition_tree(c.oid) p WHERE c.relkind = 'p' AND p.isleaf
+    ) t
+    JOIN pg_class r ON r.oid = t.relid
+    LEFT JOIN pg_stat_user_tables s ON s.relid = t.relid
+    WHERE n.nspname = 'app'
+    AND c.relkind IN ('r', 'p', 'm')
+    AND NOT c.relispartition
+    GROUP BY c.relname
+    ORDER BY c.relname;
+"""
+
+_stats = None
+_stats_loaded_at = 0.0
+_write_sample = None  # (monotonic time, {table: cumulative writes})
+
+
+def _ttl():
+    return float(os.environ.get('SCHEMA_CACHE_TTL', 300))
+
+
+def _stats_ttl():
+    return float(os.environ.get('STATS_CACHE_TTL', 60))
+
+
+def _start_listener():
+    global _listening
+    if _listening or os.environ.get('SCHEMA_LISTEN', '1') == '0':
+        return
+    _listening = True
+    notify.subscribe(SCHEMA_CHANNEL, lambda payload: invalidate())
+
+
+def _load():
+    # Invalidations come from the primary, so the catalog is read there too.
+    with connection(primary=True) as conn:
+        cur = conn.cursor()
+        cur.execute(CATALOG_QUERY)
+        rows = cur.fetchall()
+        cur.close()
+
+    tables = {}
+    searchable = set()
+    derived = set()
+    partition_columns = {}
+    for table, name, type_, sql_type, nullable, default, is_pk, is_derived, is_partition_key in rows:
+        columns = tables.setdefault(table, [])
+        if is_derived:
+            derived.add(table)
+        if is_partition_key:
+            partition_columns[table] = name
+        if name is None:
+            continue
+        if name == SEARCH_COLUMN:
+            searchable.add(table)
+            continue
+        columns.append({
+            "name": name,
+            "type": type_,
+            "sql_type": sql_type,
+            "nullable": nullable,
+            "default": default,
+            "is_pk": is_pk
+        })
+    return tables, frozenset(searchable), frozenset(derived), partition_columns
+
+
+def _snapshot():
+    global _tables, _searchable, _derived, _partition_columns, _loaded_at
+    tables = _tables
+    if tables is not None and time.monotonic() - _loaded_at < _ttl():
+        return tables
+
+    _start_listener()
+    with _lock:
+        if _tables is not None and time.monotonic() - _loaded_at < _ttl():
+            return _tables
+        generation = _generation
+        tables, searchable, derived, partition_columns = _load()
+        # Only publish if nothing invalidated the catalog while loading.
+        if generation == _generation:
+            _tables = tables
+            _searchable = searchable
+            _derived = derived
+            _partition_columns = partition_columns
+            _loaded_at = time.monotonic()
+        return tables
+
+
+def invalidate():
+    """Drops the cached schema so the next lookup reloads it."""
+    global _tables, _stats, _generation
+    _generation += 1
+    _tables = None
+    _stats = None
+
+
+def _reset_after_fork():
+    # Each worker loads its own snapshot and runs its own listener.
+    global _tables, _stats, _write_sample, _listening, _lock
+    _tables = None
+    _stats = None
+    _write_sample = None
+    _listening = False
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def generation():
+    """Counter bumped by every invalidate(), i.e. every schema change."""
+    return _generation
+
+
+def is_loaded():
+    """True while a cached snapshot is fresh, i.e. lookups won't hit the database."""
+    return _tables is not None and time.monotonic() - _loaded_at < _ttl()
+
+
+def is_known(table_name):
+    """True if the cached snapshot has the table. Never loads the catalog."""
+    tables = _tables
+    return tables is not None and table_name in tables
+
+
+def get_tables():
+    """Returns the names of all tables in the 'app' schema."""
+    return list(_snapshot().keys())
+
+
+def has_search(table_name):
+    """True if the table has the generated full-text search column."""
+    _snapshot()
+    return table_name in _searchable
+
+
+def is_derived(table_name):
+    """True if the name is a derived object (a materialized view), which is read-only."""
+    _snapshot()
+    return table_name in _derived
+
+
+def partition_column(table_name):
+    """The range-partition column of a partitioned table, or None."""
+    _snapshot()
+    return _partition_columns.get(table_name)
+
+
+def get_columns(table_name):
+    """Returns a copy of the column list for a table, or None if it doesn't exist."""
+    columns = _snapshot().get(table_name)
+    if columns is None:
+        return None
+    return [dict(c) for c in columns]
+
+
+def get_stats():
+    """
+    Estimated rows, table and index size in bytes, last vacuum and analyze
+    and the write rate of every object, cached for STATS_CACHE_TTL seconds.
+    writes_per_sec covers the time since the previous sample and is None
+    on the first one.
+    """
+    global _stats, _stats_loaded_at, _write_sample
+    stats = _stats
+    if stats is not None and time.monotonic() - _stats_loaded_at < _stats_ttl():
+        return stats
+
+    with _lock:
+        if _stats is not None and time.monotonic() - _stats_loaded_at < _stats_ttl():
+            return _stats
+        # Activity counters are per server, so read them where writes happen.
+        with connection(primary=True) as conn:
+            cur = conn.cursor()
+            cur.execute(STATS_QUERY)
+            rows = cur.fetchall()
+            cur.close()
+
+        now = time.monotonic()
+        previous_at, previous = _write_sample or (None, {})
+        stats = {}
+        for table, rows_estimate, table_bytes, index_bytes, last_vacuum, last_analyze, writes in rows:
+            rate = None
+            if table in previous and now > previous_at:
+                rate = max(writes - previous[table], 0) / (now - previous_at)
+            stats[table] = {
+                "rows_estimate": rows_estimate,
+                "table_bytes": table_bytes,
+                "index_bytes": index_bytes,
+                "total_bytes": table_bytes + index_bytes,
+                "last_vacuum": last_vacuum,
+                "last_analyze": last_analyze,
+                "writes_per_sec": rate,
+            }
+        _write_sample = (now, {row[0]: row[-1] for row in rows})
+        _stats = stats
+        _stats_loaded_at = now
+        return stats
+
@@ -0,0 +1,327 @@
+import collections
+import os
+import threading
+import time
+
+from app import catalog, ddl, notify, serialize
+from app.db import checkout
+
+# Change feed: on tables with the feed enabled (enable(), an admin action,
+# since it copies every written row), triggers write each changed row to
+# internal.change_events and send one NOTIFY per transaction and table
+# (payload "table:txid"). The process-wide LISTEN connection in app.notify
+# hands these to _on_notify, which reads the transaction's events once and
+# fans them out to every subscriber of that table. Each subscriber has a
+# bounded buffer; a subscriber that falls behind replays from the table
+# instead, the same way a client resumes with Last-Event-ID.
+
+BUFFER_SIZE = int(os.environ.get('CHANGE_BUFFER_SIZE', 1000))
+HEARTBEAT = float(os.environ.get('CHANGE_HEARTBEAT', 15))
+MAX_SUBSCRIBERS = int(os.environ.get('CHANGE_MAX_SUBSCRIBERS', 500))
+# Outside gevent workers every open feed holds one of the worker's threads
+# for as long as it is open, so feeds may take at most half of them.
+if os.environ.get('GUNICORN_WORKER_CLASS') != 'gevent':
+    MAX_SUBSCRIBERS = min(MAX_SUBSCRIBERS, int(os.environ.get('GUNICORN_THREADS', 4)) // 2)
+RETENTION_HOURS = float(os.environ.get('CHANGE_RETENTION_HOURS', 24))
+PURGE_INTERVAL = float(os.environ.get('CHANGE_PURGE_INTERVAL', 3600))
+REPLAY_BATCH = 1000
+LISTEN_TIMEOUT = 5
+
+EVENT_COLUMNS = "id, operation, record_pk, data, created_at"
+
+_subscribers = {}  # table -> set of Subscription
+_lock = threading.Lock()
+_listening = False
+_purger = None
+
+
+class Subscription:
+    """One client's bounded event buffer, filled by the listener thread."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.events = collections.deque()
+        self.overflowed = False
+        self.cond = threading.Condition()
+
+    def push(self, events):
+        with self.cond:
+            if not self.overflowed:
+                if len(self.events) + len(events) > BUFFER_SIZE:
+                    # Dropped events are replayed from the table by stream().
+                    self.overflowed = True
+                    self.events.clear()
+                else:
+                    self.events.extend(events)
+            self.cond.notify()
+
+    def mark_overflowed(self):
+        with self.cond:
+            self.overflowed = True
+            self.events.clear()
+            self.cond.notify()
+
+    def wait(self, timeout):
+        """Returns (events, overflowed) once something arrives or after `timeout`."""
+        with self.cond:
+            if not self.events and not self.overflowed:
+                self.cond.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            overflowed, self.overflowed = self.overflowed, False
+        return events, overflowed
+
+
+def _reset_after_fork():
+    global _lock, _listening, _purger
+    _subscribers.clear()
+    _lock = threading.Lock()
+    _listening = False
+    _purger = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _event_dict(row):
+    event_id, operation, record_pk, data, created_at = row
+    return {"id": event_id, "operation": operation, "pk": record_pk, "record": data, "changed_at": created_at}
+
+
+def _on_notify(payload):
+    with _lock:
+        if payload is None:
+            # Notifications may have been lost while reconnecting.
+            subscriptions = [s for subs in _subscribers.values() for s in subs]
+        else:
+            table_name, _, txid = payload.rpartition(':')
+            subscriptions = list(_subscribers.get(table_name, ()))
+    if not subscriptions:
+        return
+    if payload is None:
+        for sub in subscriptions:
+            sub.mark_overflowed()
+        return
+
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {EVENT_COLUMNS} FROM internal.change_events
+            WHERE txid = %s::xid8 AND table_name = %s
+            ORDER BY id
+        """, (txid, table_name))
+        events = [_event_dict(row) for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+    if events:
+        for sub in subscriptions:
+            sub.push(events)
+
+
+def _subscriber_count():
+    return sum(len(subs) for subs in _subscribers.values())
+
+
+def subscribe(table_name):
+    """
+    Registers a live subscription to a table's changes. Returns once the
+    process LISTENs on the change channel, so every commit after that is
+    delivered; if that takes longer than LISTEN_TIMEOUT, the subscription
+    starts by catching up from the table instead.
+    """
+    global _listening
+    with _lock:
+        if _subscriber_count() >= MAX_SUBSCRIBERS:
+            raise RuntimeError("Too many change feed subscribers, try again later")
+        sub = Subscription(table_name)
+        _subscribers.setdefault(table_name, set()).add(sub)
+        start_listener = not _listening
+        _listening = True
+    if start_listener:
+        notify.subscribe(ddl.CHANGES_CHANNEL, _on_notify)
+    if not notify.wait_listening(ddl.CHANGES_CHANNEL, LISTEN_TIMEOUT):
+        sub.mark_overflowed()
+    start_purger()
+    return sub
+
+
+def unsubscribe(sub):
+    with _lock:
+        subs = _subscribers.get(sub.table_name)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del _subscribers[sub.table_name]
+
+
+def replay(table_name, after_id, limit=REPLAY_BATCH):
+    """Stored events of a table after `after_id`, oldest first."""
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {EVENT_COLUMNS} FROM internal.change_events
+            WHERE table_name = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (table_name, after_id, limit))
+        events = [_event_dict(row) for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+    return events
+
+
+def _latest_id(table_name):
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT max(id) FROM internal.change_events WHERE table_name = %s", (table_name,))
+        latest = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    return latest or 0
+
+
+def _format(event, include_rows):
+    data = {"operation": event["operation"], "pk": event["pk"], "changed_at": event["changed_at"]}
+    if include_rows:
+        data["record"] = event["record"]
+    return f"id: {event['id']}\nevent: {event['operation']}\ndata: {serialize.dumps_str(data)}\n\n"
+
+
+def _check_table(table_name):
+    if catalog.get_columns(table_name) is None:
+        raise ValueError("Table does not exist")
+    if catalog.is_derived(table_name):
+        raise ValueError("Derived objects have no change feed")
+
+
+def is_enabled(table_name):
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM internal.change_feeds WHERE table_name = %s", (table_name,))
+        enabled = cur.fetchone() is not None
+        conn.commit()
+        cur.close()
+    return enabled
+
+
+def enable(table_name):
+    """Starts recording a table's changes for the feed. Earlier writes have no events."""
+    _check_table(table_name)
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO internal.change_feeds (table_name) VALUES (%s) ON CONFLICT DO NOTHING",
+                    (table_name,))
+        ddl.install_change_triggers(cur, table_name)
+        conn.commit()
+        cur.close()
+
+
+def disable(table_name):
+    """Stops recording a table's changes and deletes its stored events."""
+    _check_table(table_name)
+    with checkout() as conn:
+        cur = conn.cursor()
+        ddl.drop_change_triggers(cur, table_name)
+        cur.execute("DELETE FROM internal.change_feeds WHERE table_name = %s", (table_name,))
+        cur.execute("DELETE FROM internal.change_events WHERE table_name = %s", (table_name,))
+        conn.commit()
+        cur.close()
+
+
+def stream(table_name, last_event_id=None, include_rows=False):
+    """
+    Validates a change-feed request and returns a generator of SSE frames.
+    With `last_event_id`, stored events after it are sent first; otherwise
+    the feed starts with changes committed from now on.
+    """
+    _check_table(table_name)
+    if not is_enabled(table_name):
+        raise ValueError("The change feed is not enabled for this object")
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            raise ValueError("Invalid Last-Event-ID")
+    # Checked again in subscribe(); this lets the caller answer before streaming.
+    if _subscriber_count() >= MAX_SUBSCRIBERS:
+        raise RuntimeError("Too many change feed subscribers, try again later")
+    return _frames(table_name, last_event_id, include_rows)
+
+
+def _frames(table_name, last_event_id, include_rows):
+    # Ids commit out of order, so live events are deduplicated against the
+    # recently sent ids rather than against the highest one.
+    sent = collections.deque(maxlen=BUFFER_SIZE * 2)
+    sent_ids = set()
+
+    def emit(event):
+        if len(sent) == sent.maxlen:
+            sent_ids.discard(sent[0])
+        sent.append(event["id"])
+        sent_ids.add(event["id"])
+        return _format(event, include_rows)
+
+    # Subscribed on first iteration, so a stream that never starts holds
+    # nothing. subscribe() returns once LISTEN is active and the position is
+    # read after that, so no commit falls between the two.
+    sub = subscribe(table_name)
+    try:
+        position = last_event_id if last_event_id is not None else _latest_id(table_name)
+        yield f"retry: {int(HEARTBEAT * 1000)}\n\n"
+        catch_up = last_event_id is not None
+        while True:
+            if catch_up:
+                while True:
+                    events = replay(sub.table_name, position)
+                    for event in events:
+                        if event["id"] not in sent_ids:
+                            yield emit(event)
+                        position = max(position, event["id"])
+                    if len(events) < REPLAY_BATCH:
+                        break
+                catch_up = False
+
+            events, overflowed = sub.wait(HEARTBEAT)
+            if overflowed:
+                catch_up = True
+                continue
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                if event["id"] not in sent_ids:
+                    yield emit(event)
+                    position = max(position, event["id"])
+    finally:
+        unsubscribe(sub)
+
+
+def start_purger():
+    global _purger
+    if _purger is not None and _purger.is_alive():
+        return
+    with _lock:
+        if _purger is None or not _purger.is_alive():
+            _purger = threading.Thread(target=_purge_loop, name="change-purge", daemon=True)
+            _purger.start()
+
+
+def _purge_loop():
+    while True:
+        try:
+            purge()
+        except Exception as e:
+            print(f"Warning: Change event purge failed: {e}")
+        time.sleep(PURGE_INTERVAL)
+
+
+def purge():
+    """Deletes change events older than CHANGE_RETENTION_HOURS."""
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM internal.change_events
+            WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (RETENTION_HOURS * 3600,))
+        conn.commit()
+        cur.close()
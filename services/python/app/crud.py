@@ -1,166 +1,813 @@
-import psycopg2
+import base64
+import csv
+import html
+import io
+import json
 import os
+import time
+import uuid
+from psycopg2.extras import execute_values
+from app.db import checkout, connection, transaction
+from app import advisor, audit, catalog, ddl, prepared, serialize
+from app.introspection import get_primary_key
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.environ['POSTGRES_HOST'],
-        database=os.environ['POSTGRES_DB'],
-        user=os.environ['POSTGRES_USER'],
-        password=os.environ['POSTGRES_PASSWORD']
-    )
+DEFAULT_PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+BULK_PAGE_SIZE = int(os.environ.get('BULK_PAGE_SIZE', 1000))
+MAX_DUPLICATES = int(os.environ.get('MAX_DUPLICATES', 1000))
+MAX_AGGREGATE_GROUPS = int(os.environ.get('MAX_AGGREGATE_GROUPS', 10000))
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+BUCKET_UNITS = ('minute', 'hour', 'day', 'week', 'month', 'quarter', 'year')
+MAX_CACHED_STATEMENTS = int(os.environ.get('MAX_CACHED_STATEMENTS', 2000))
 
-def list_records(table_name, filters=None, sort_by=None, order='ASC'):
-    """Generic SELECT * from app.table with optional filtering and sorting"""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-    
-    columns = [c['name'] for c in get_table_details(table_name)]
-    
-    query = f'SELECT * FROM app."{table_name}"'
+# Generated single-record SQL per (table, operation, column set); dropped
+# whenever the schema catalog is invalidated.
+_statements = {}
+_statements_generation = None
+
+def _get_columns(table_name):
+    """Column metadata from the schema catalog; raises if the table is unknown."""
+    columns = catalog.get_columns(table_name)
+    if columns is None:
+        raise ValueError("Table does not exist")
+    return columns
+
+def _get_writable_columns(table_name):
+    """Like _get_columns, but rejects derived objects, which are read-only."""
+    columns = _get_columns(table_name)
+    if catalog.is_derived(table_name):
+        raise ValueError("Derived objects are read-only")
+    return columns
+
+def _generated_columns(table_name, pk_col):
+    """
+    Columns clients may not set. A partitioned object's primary key also
+    covers the partition column, so its id is only unique while it is
+    always generated (see partitions.register).
+    """
+    return {pk_col} if pk_col and catalog.partition_column(table_name) else set()
+
+def _require_pk(columns):
+    pk_col = get_primary_key(columns)
+    if not pk_col:
+        raise ValueError("Table has no primary key")
+    return pk_col
+
+def _cached_statement(key, build):
+    """SQL text for `key`, built once per schema generation."""
+    global _statements_generation
+    generation = catalog.generation()
+    if generation != _statements_generation or len(_statements) >= MAX_CACHED_STATEMENTS:
+        _statements.clear()
+        _statements_generation = generation
+    sql = _statements.get(key)
+    if sql is None:
+        sql = _statements[key] = build()
+    return sql
+
+def _column_list(details):
+    """Quoted column names; `*` would also return the hidden search column."""
+    return ", ".join([f'"{c["name"]}"' for c in details])
+
+def _project(details, fields):
+    """Column dicts selected by a `fields` projection, in request order (all if empty)."""
+    if not fields:
+        return details
+    by_name = {c['name']: c for c in details}
+    unknown = [f for f in fields if f not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [by_name[f] for f in dict.fromkeys(fields)]
+
+def _filter_clauses(col_names, filters):
+    """Equality filters on known columns, as (clauses, params)."""
+    clauses = []
     params = []
-    
-    # Filtering
     if filters:
-        filter_clauses = []
         for col, val in filters.items():
-            if col in columns:
-                filter_clauses.append(f'"{col}" = %s')
+            if col in col_names:
+                clauses.append(f'"{col}" = %s')
                 params.append(val)
-        if filter_clauses:
-            query += " WHERE " + " AND ".join(filter_clauses)
-            
+    return clauses, params
+
+def _normalize_order(order):
+    order = (order or 'ASC').upper()
+    return order if order in ['ASC', 'DESC'] else 'ASC'
+
+def _build_list_query(table_name, filters=None, sort_by=None, order='ASC', fields=None):
+    """SELECT for list_records/export_records as (query, params, selected column names)."""
+    details = _get_columns(table_name)
+    columns = [c['name'] for c in details]
+    selected = _project(details, fields)
+
+    query = f'SELECT {_column_list(selected)} FROM app."{table_name}"'
+
+    # Filtering
+    filter_clauses, params = _filter_clauses(columns, filters)
+    if filter_clauses:
+        query += " WHERE " + " AND ".join(filter_clauses)
+
     # Sorting
     if sort_by and sort_by in columns:
-        if order.upper() not in ['ASC', 'DESC']:
-            order = 'ASC'
-        query += f' ORDER BY "{sort_by}" {order}'
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+        query += f' ORDER BY "{sort_by}" {_normalize_order(order)}'
+
+    return query, params, [c['name'] for c in selected]
+
+def list_records(table_name, filters=None, sort_by=None, order='ASC'):
+    """Generic SELECT from app.table with optional filtering and sorting"""
+    query, params, columns = _build_list_query(table_name, filters, sort_by, order)
+
+    with connection() as conn:
+        cur = conn.cursor()
+        started = time.perf_counter()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        advisor.record_usage(table_name, [c for c in (filters or {}) if c in columns],
+                             sort_by if sort_by in columns else None, time.perf_counter() - started)
+        cur.close()
     return rows
 
-def get_record(table_name, record_id):
-    """Retrieve a single record by its primary key."""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-         
-    details = get_table_details(table_name)
-    pk_col = next((c['name'] for c in details if c['is_pk']), None)
-    if not pk_col:
-        raise ValueError("Table has no primary key")
-        
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(f'SELECT * FROM app."{table_name}" WHERE "{pk_col}" = %s', (record_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row
+def export_records(table_name, filters=None, sort_by=None, order='ASC', fmt='ndjson', fields=None):
+    """
+    Validates an export request and returns a generator of encoded chunks.
+    Filters and sorting match list_records; validation happens up front so
+    errors surface before the response starts streaming.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}'")
+    query, params, columns = _build_list_query(table_name, filters, sort_by, order, fields)
+    return _stream_rows(query, params, columns, fmt)
 
-def create_record(table_name, data):
-    """Generic INSERT into app.table"""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-         
-    columns = get_table_details(table_name)
+def _stream_rows(query, params, columns, fmt):
+    """
+    Streams rows through a named (server-side) cursor, fetching
+    EXPORT_BATCH_SIZE rows per round trip so memory stays flat and the
+    first chunk is sent before the full result has been produced.
+    """
+    # A dedicated connection: the stream outlives the request's unit of work.
+    with checkout() as conn:
+        cur = conn.cursor(name=f'export_{uuid.uuid4().hex}')
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(query, params)
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == 'csv':
+            writer.writerow(columns)
+
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buf.write(serialize.dumps_str(dict(zip(columns, row))))
+                    buf.write('\n')
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+
+        if buf.tell():
+            yield buf.getvalue()
+        cur.close()
+
+def _page_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def _encode_cursor(sort_by, order, values):
+    payload = json.dumps({"s": sort_by, "o": order, "v": values}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def _decode_cursor(token, sort_by, order):
+    """Returns the keyset values from an opaque cursor issued for the same sort."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["v"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid pagination cursor")
+    if payload.get("s") != sort_by or payload.get("o") != order:
+        raise ValueError("Pagination cursor does not match the current sort order")
+    return values
+
+def _keyset_clause(sort_by, pk_col, order, values, types):
+    """
+    WHERE clause selecting rows after the cursor position in the ordering
+    (sort_by, pk). Postgres sorts NULLs last ascending and first descending,
+    so a NULL sort value needs its own branch. Cursor values come back from
+    JSON, so each is cast to its column's sql_type (`types`, name -> type):
+    compared as a float8, a `real` 0.1 would sort after itself, and a bare
+    `character` cast would cut a char(3) value to one character.
+    """
+    op = '>' if order == 'ASC' else '<'
+    pk_param = f'%s::{types[pk_col]}'
+    if not sort_by:
+        return f'"{pk_col}" {op} {pk_param}', [values[0]]
+
+    sort_val, pk_val = values
+    if sort_val is None:
+        if order == 'ASC':
+            return f'("{sort_by}" IS NULL AND "{pk_col}" > {pk_param})', [pk_val]
+        return f'(("{sort_by}" IS NULL AND "{pk_col}" < {pk_param}) OR "{sort_by}" IS NOT NULL)', [pk_val]
+
+    sort_param = f'%s::{types[sort_by]}'
+    clause = f'("{sort_by}" {op} {sort_param} OR ("{sort_by}" = {sort_param} AND "{pk_col}" {op} {pk_param})'
+    if order == 'ASC':
+        clause += f' OR "{sort_by}" IS NULL'
+    return clause + ')', [sort_val, sort_val, pk_val]
+
+def plan_rows(plan):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def _estimate_rows(cur, query, params):
+    """Planner row estimate for a query, without executing it."""
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    return plan_rows(cur.fetchone()[0])
+
+def build_page_query(table_name, filters=None, sort_by=None, order='ASC', limit=None, after=None,
+                     fields=None):
+    """
+    Keyset-paginated SELECT ordered by (sort_by, pk), as (query, params,
+    count_query, count_params, page). `page` carries what finish_page
+    needs to trim the look-ahead row and encode the next cursor, and the
+    selected column names. With a `fields` projection, the pk and sort
+    columns are still read for the cursor but dropped by finish_page.
+    """
+    details = _get_columns(table_name)
+    pk_col = _require_pk(details)
+    columns = [c['name'] for c in details]
+
+    order = _normalize_order(order)
+    if sort_by not in columns or sort_by == pk_col:
+        sort_by = None
+    limit = _page_limit(limit)
+
+    selected = [c['name'] for c in _project(details, fields)]
+    read = selected + [c for c in dict.fromkeys([pk_col, sort_by]) if c and c not in selected]
+
+    read_str = ", ".join([f'"{c}"' for c in read])
+    base_query = f'SELECT {read_str} FROM app."{table_name}"'
+    filter_clauses, params = _filter_clauses(columns, filters)
+    count_query = base_query
+    if filter_clauses:
+        count_query += " WHERE " + " AND ".join(filter_clauses)
+    count_params = list(params)
+
+    if after:
+        clause, keyset_params = _keyset_clause(sort_by, pk_col, order,
+                                               _decode_cursor(after, sort_by, order),
+                                               {c['name']: c['sql_type'] for c in details})
+        filter_clauses.append(clause)
+        params.extend(keyset_params)
+
+    query = base_query
+    if filter_clauses:
+        query += " WHERE " + " AND ".join(filter_clauses)
+    if sort_by:
+        query += f' ORDER BY "{sort_by}" {order}, "{pk_col}" {order}'
+    else:
+        query += f' ORDER BY "{pk_col}" {order}'
+    # One extra row tells us whether another page exists.
+    query += ' LIMIT %s'
+    params.append(limit + 1)
+
+    page = {
+        "limit": limit,
+        "sort_by": sort_by,
+        "order": order,
+        "pk_idx": read.index(pk_col),
+        "sort_idx": read.index(sort_by) if sort_by else None,
+        "filter_columns": [c for c in (filters or {}) if c in columns],
+        "columns": selected,
+    }
+    return query, params, count_query, count_params, page
+
+def finish_page(rows, page):
+    """Drops the look-ahead row and cursor-only columns; returns (rows, next cursor or None)."""
+    limit = page["limit"]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if page["sort_idx"] is None:
+            values = [last[page["pk_idx"]]]
+        else:
+            values = [last[page["sort_idx"]], last[page["pk_idx"]]]
+        next_cursor = _encode_cursor(page["sort_by"], page["order"], values)
+    width = len(page["columns"])
+    if rows and len(rows[0]) > width:
+        rows = [row[:width] for row in rows]
+    return rows, next_cursor
+
+def list_records_page(table_name, filters=None, sort_by=None, order='ASC',
+                      limit=None, after=None, estimate_total=False, fields=None):
+    """
+    Keyset-paginated SELECT ordered by (sort_by, pk). Returns a dict with
+    the page's rows, their column names, an opaque cursor for the next page
+    (or None) and, if requested, the planner's estimate of the total
+    matching rows. `fields` limits the columns read and returned.
+    """
+    query, params, count_query, count_params, page = build_page_query(
+        table_name, filters, sort_by, order, limit, after, fields)
+
+    with connection() as conn:
+        cur = conn.cursor()
+        started = time.perf_counter()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        advisor.record_usage(table_name, page["filter_columns"], page["sort_by"],
+                             time.perf_counter() - started)
+        total = _estimate_rows(cur, count_query, count_params) if estimate_total else None
+        cur.close()
+
+    rows, next_cursor = finish_page(rows, page)
+    return {"rows": rows, "columns": page["columns"], "next": next_cursor, "total_estimate": total}
+
+# ts_headline marks matches with these; the snippet is HTML-escaped and
+# they are then replaced by <mark> tags.
+_MARK_START = '\x01'
+_MARK_STOP = '\x02'
+_HEADLINE_OPTIONS = f'StartSel={_MARK_START}, StopSel={_MARK_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+def _snippet(headline):
+    if headline is None:
+        return None
+    return html.escape(headline).replace(_MARK_START, '<mark>').replace(_MARK_STOP, '</mark>')
+
+def search_records(table_name, q, filters=None, limit=None, after=None):
+    """
+    Full-text search over all text columns of a table, best match first.
+    Uses the generated search column and its GIN index when the table has
+    one (see ddl.install_search), otherwise builds the document per row.
+    Returns {"results": [{"record", "rank", "snippet"}], "next": cursor};
+    snippets are HTML-escaped with matches wrapped in <mark>.
+    """
+    q = (q or '').strip()
+    if not q:
+        raise ValueError("Search query is required")
+    details = _get_columns(table_name)
+    pk_col = _require_pk(details)
+    columns = [c['name'] for c in details]
+    text_columns = [c['name'] for c in details if c['type'] in catalog.TEXT_TYPES]
+    if not text_columns:
+        raise ValueError("Table has no text columns to search")
+    limit = _page_limit(limit)
+
+    if catalog.has_search(table_name):
+        document = f'"{catalog.SEARCH_COLUMN}"'
+    else:
+        document = ddl.search_document_sql(text_columns)
+    filter_clauses, filter_params = _filter_clauses(columns, filters)
+    where = " AND ".join([f'{document} @@ "_q"'] + filter_clauses)
+
+    keyset = ''
+    keyset_params = []
+    if after:
+        rank, pk_val = _decode_cursor(after, '_rank', 'DESC')
+        pk_type = next(c['sql_type'] for c in details if c['name'] == pk_col)
+        keyset = f'WHERE ("_rank" < %s OR ("_rank" = %s AND "{pk_col}" > %s::{pk_type}))'
+        keyset_params = [rank, rank, pk_val]
+
+    # The rank is cast to float8 so it survives the JSON cursor exactly.
+    # Headlines are costly, so they are only built for the page's rows.
+    col_str = _column_list(details)
+    query = f"""
+        SELECT {col_str}, "_rank",
+               ts_headline('{ddl.SEARCH_CONFIG}'::regconfig, {ddl.search_text_sql(text_columns)}, "_q", %s)
+        FROM (
+            SELECT * FROM (
+                SELECT {col_str}, ts_rank({document}, "_q")::float8 AS "_rank", "_q"
+                FROM app."{table_name}", websearch_to_tsquery('{ddl.SEARCH_CONFIG}'::regconfig, %s) AS "_q"
+                WHERE {where}
+            ) AS matches
+            {keyset}
+            ORDER BY "_rank" DESC, "{pk_col}" ASC
+            LIMIT %s
+        ) AS page
+        ORDER BY "_rank" DESC, "{pk_col}" ASC
+    """
+    params = [_HEADLINE_OPTIONS, q] + filter_params + keyset_params + [limit + 1]
+
+    with connection() as conn:
+        cur = conn.cursor()
+        started = time.perf_counter()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        advisor.record_usage(table_name, [c for c in (filters or {}) if c in columns], None,
+                             time.perf_counter() - started)
+        cur.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor('_rank', 'DESC', [last[len(columns)], last[columns.index(pk_col)]])
+
+    results = [{
+        "record": dict(zip(columns, row)),
+        "rank": row[len(columns)],
+        "snippet": _snippet(row[len(columns) + 1]),
+    } for row in rows]
+    return {"results": results, "next": next_cursor}
+
+def aggregate_records(table_name, group_by=None, metrics=None, bucket=None, filters=None, limit=None):
+    """
+    GROUP BY aggregation computed in Postgres.
+
+    group_by: column names to group on.
+    metrics:  specs such as 'count', 'count:col', 'sum:col', 'avg:col',
+              'min:col', 'max:col'; sum/avg need numeric columns, min/max
+              numeric or date/timestamp columns. Defaults to ['count'].
+    bucket:   'col:unit' groups a date/timestamp column by date_trunc(unit).
+    filters:  equality filters, as for list_records.
+
+    Returns a list of dicts with one key per group column ('bucket' for the
+    time bucket) and one per metric ('count', 'sum_<col>', ...), ordered by
+    the group keys.
+    """
+    details = _get_columns(table_name)
+    types = {c['name']: c['type'] for c in details}
+    columns = list(types)
+
+    select = []
+    select_params = []
+    keys = []
+
+    if bucket:
+        col, _, unit = bucket.partition(':')
+        if types.get(col) not in catalog.TEMPORAL_TYPES:
+            raise ValueError(f"Bucket column '{col}' must be a date or timestamp column")
+        unit = unit or 'day'
+        if unit not in BUCKET_UNITS:
+            raise ValueError(f"Bucket unit must be one of: {', '.join(BUCKET_UNITS)}")
+        select.append(f'date_trunc(%s, "{col}") AS "bucket"')
+        select_params.append(unit)
+        keys.append('bucket')
+
+    for col in group_by or []:
+        if col not in types:
+            raise ValueError(f"Unknown group_by column '{col}'")
+        if col in keys:
+            continue
+        select.append(f'"{col}"')
+        keys.append(col)
+    group_count = len(select)
+
+    for spec in metrics or ['count']:
+        func, _, col = spec.partition(':')
+        if func not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unknown aggregate '{func}'; use one of: {', '.join(AGGREGATE_FUNCTIONS)}")
+        if func == 'count' and not col:
+            select.append('count(*)')
+            keys.append('count')
+            continue
+        if col not in types:
+            raise ValueError(f"Unknown column '{col}' in '{spec}'")
+        allowed = catalog.NUMERIC_TYPES
+        if func in ('min', 'max'):
+            allowed = catalog.NUMERIC_TYPES + catalog.TEMPORAL_TYPES
+        if func != 'count' and types[col] not in allowed:
+            raise ValueError(f"'{func}' is not supported on column '{col}' of type {types[col]}")
+        select.append(f'{func}("{col}")')
+        keys.append(f'{func}_{col}')
+
+    query = f'SELECT {", ".join(select)} FROM app."{table_name}"'
+    filter_clauses, params = _filter_clauses(columns, filters)
+    if filter_clauses:
+        query += " WHERE " + " AND ".join(filter_clauses)
+    if group_count:
+        ordinals = ", ".join(str(i) for i in range(1, group_count + 1))
+        query += f' GROUP BY {ordinals} ORDER BY {ordinals}'
+    query += ' LIMIT %s'
+    params = select_params + params + [max(1, min(int(limit or MAX_AGGREGATE_GROUPS), MAX_AGGREGATE_GROUPS))]
+
+    with connection() as conn:
+        cur = conn.cursor()
+        started = time.perf_counter()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        advisor.record_usage(table_name, [c for c in (filters or {}) if c in columns], None,
+                             time.perf_counter() - started)
+        cur.close()
+    return [dict(zip(keys, row)) for row in rows]
+
+def _row_dict(cur, row):
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+# Single-record statements are built separately from their execution so
+# the async API (app/asgi.py) applies exactly the same validation.
+
+def build_get(table_name, record_id, fields=None):
+    details = _get_columns(table_name)
+    pk_col = _require_pk(details)
+    selected = _project(details, fields)
+    sql = _cached_statement(
+        (table_name, 'get', tuple(c['name'] for c in selected)),
+        lambda: f'SELECT {_column_list(selected)} FROM app."{table_name}" WHERE "{pk_col}" = %s')
+    return sql, (record_id,)
+
+def build_insert(table_name, data):
+    """INSERT ... RETURNING as (sql, values, pk column or None)."""
+    columns = _get_writable_columns(table_name)
     col_names = {c['name'] for c in columns}
-    
+
     clean_data = {k: v for k, v in data.items() if k in col_names and v is not None}
-    
+
     if not clean_data:
         raise ValueError("No valid data provided")
+    generated = _generated_columns(table_name, get_primary_key(columns)) & set(clean_data)
+    if generated:
+        raise ValueError(f"'{', '.join(sorted(generated))}' is generated and cannot be set")
 
-    cols = list(clean_data.keys())
-    values = list(clean_data.values())
-    
-    col_str = ", ".join([f'"{c}"' for c in cols])
-    val_placeholders = ", ".join(["%s"] * len(values))
-    sql = f'INSERT INTO app."{table_name}" ({col_str}) VALUES ({val_placeholders})'
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(sql, values)
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Sorted, so the same column set always maps to the same statement.
+    cols = tuple(sorted(clean_data))
+    values = [clean_data[c] for c in cols]
 
-def update_record(table_name, record_id, data):
-    """Generic UPDATE for app.table"""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-         
-    details = get_table_details(table_name)
-    pk_col = next((c['name'] for c in details if c['is_pk']), None)
+    def build():
+        col_str = ", ".join([f'"{c}"' for c in cols])
+        val_placeholders = ", ".join(["%s"] * len(cols))
+        return f'INSERT INTO app."{table_name}" ({col_str}) VALUES ({val_placeholders}) RETURNING {_column_list(columns)}'
+    return _cached_statement((table_name, 'insert', cols), build), values, get_primary_key(columns)
+
+def build_update(table_name, record_id, data):
+    """
+    UPDATE ... RETURNING as (sql, values, pk column, changes). With nothing
+    to update, `changes` is False and the statement is a plain read of the
+    current record.
+    """
+    details = _get_writable_columns(table_name)
+    pk_col = _require_pk(details)
     col_names = {c['name'] for c in details}
-    
-    if not pk_col:
-        raise ValueError("Table has no primary key")
 
     clean_data = {k: v for k, v in data.items() if k in col_names and k != pk_col}
-    
+
     if not clean_data:
-        return # Nothing to update
-        
-    set_clauses = [f'"{k}" = %s' for k in clean_data.keys()]
-    values = list(clean_data.values())
+        # Nothing to update
+        sql, params = build_get(table_name, record_id)
+        return sql, list(params), pk_col, False
+
+    cols = tuple(sorted(clean_data))
+    values = [clean_data[c] for c in cols]
     values.append(record_id)
-    
-    sql = f'UPDATE app."{table_name}" SET {", ".join(set_clauses)} WHERE "{pk_col}" = %s'
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(sql, values)
-    conn.commit()
-    cur.close()
-    conn.close()
+
+    def build():
+        set_clauses = ", ".join([f'"{k}" = %s' for k in cols])
+        return f'UPDATE app."{table_name}" SET {set_clauses} WHERE "{pk_col}" = %s RETURNING {_column_list(details)}'
+    return _cached_statement((table_name, 'update', cols), build), values, pk_col, True
+
+def build_delete(table_name, record_id):
+    details = _get_writable_columns(table_name)
+    pk_col = _require_pk(details)
+    sql = _cached_statement(
+        (table_name, 'delete', ()),
+        lambda: f'DELETE FROM app."{table_name}" WHERE "{pk_col}" = %s RETURNING {_column_list(details)}')
+    return sql, (record_id,), pk_col
+
+def build_duplicate(table_name, record_id, count=1):
+    """INSERT ... SELECT copying a record `count` times, as (sql, params, pk column)."""
+    details = _get_writable_columns(table_name)
+    pk_col = _require_pk(details)
+
+    count = int(count)
+    if not 1 <= count <= MAX_DUPLICATES:
+        raise ValueError(f"count must be between 1 and {MAX_DUPLICATES}")
+
+    # Fields to exclude: pk_col and any common auto-generated fields,
+    # which fall back to their column defaults in the copies.
+    exclude = {pk_col, 'created_at', 'updated_at'}
+    cols = [c['name'] for c in details if c['name'] not in exclude]
+    if not cols:
+        raise ValueError("Table has no columns to copy")
+
+    col_str = ", ".join([f'"{c}"' for c in cols])
+    src_str = ", ".join([f'src."{c}"' for c in cols])
+    sql = (f'INSERT INTO app."{table_name}" ({col_str}) '
+           f'SELECT {src_str} FROM app."{table_name}" AS src, generate_series(1, %s) AS copies(n) '
+           f'WHERE src."{pk_col}" = %s RETURNING {_column_list(details)}')
+    return sql, (count, record_id), pk_col
+
+def get_record(table_name, record_id, fields=None):
+    """Retrieve a single record (all columns, or `fields`) by its primary key."""
+    sql, params = build_get(table_name, record_id, fields)
+
+    with connection() as conn:
+        cur = conn.cursor()
+        prepared.execute(cur, sql, params)
+        row = cur.fetchone()
+        cur.close()
+    return row
+
+def create_record(table_name, data):
+    """Generic INSERT into app.table, returning the stored record as a dict."""
+    sql, values, pk_col = build_insert(table_name, data)
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        prepared.execute(cur, sql, values)
+        record = _row_dict(cur, cur.fetchone())
+        cur.close()
+    audit.record_changes(table_name, pk_col, 'insert', [record])
+    return record
+
+def update_record(table_name, record_id, data):
+    """Generic UPDATE for app.table, returning the stored record as a dict."""
+    sql, values, pk_col, changes = build_update(table_name, record_id, data)
+
+    with (transaction() if changes else connection()) as conn:
+        cur = conn.cursor()
+        prepared.execute(cur, sql, values)
+        record = _row_dict(cur, cur.fetchone())
+        cur.close()
+    if changes and record is not None:
+        audit.record_changes(table_name, pk_col, 'update', [record])
+    return record
 
 def delete_record(table_name, record_id):
     """Generic DELETE from app.table"""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-         
-    details = get_table_details(table_name)
-    pk_col = next((c['name'] for c in details if c['is_pk']), None)
-    if not pk_col:
-        raise ValueError("Table has no primary key")
-        
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(f'DELETE FROM app."{table_name}" WHERE "{pk_col}" = %s', (record_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def duplicate_record(table_name, record_id):
-    """Duplicate a record, excluding original PK and timestamps if applicable."""
-    from app.introspection import get_tables, get_table_details
-    if table_name not in get_tables():
-         raise ValueError("Table does not exist")
-         
-    details = get_table_details(table_name)
-    pk_col = next((c['name'] for c in details if c['is_pk']), None)
-    
-    row = get_record(table_name, record_id)
-    if not row:
+    sql, params, pk_col = build_delete(table_name, record_id)
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        prepared.execute(cur, sql, params)
+        record = _row_dict(cur, cur.fetchone())
+        cur.close()
+    if record is not None:
+        audit.record_changes(table_name, pk_col, 'delete', [record])
+    return record
+
+def duplicate_record(table_name, record_id, count=1):
+    """
+    Duplicate a record `count` times with a single INSERT ... SELECT,
+    excluding the original PK and timestamps. Returns the new records.
+    """
+    sql, params, pk_col = build_duplicate(table_name, record_id, count)
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        records = [_row_dict(cur, row) for row in cur.fetchall()]
+        cur.close()
+
+    if not records:
         raise ValueError("Original record not found")
-        
-    # Map row values back to columns
-    # We need to filter out the PK and auto-generated fields
-    col_names = [c['name'] for c in details]
-    record_dict = dict(zip(col_names, row))
-    
-    # Fields to exclude: pk_col and any common auto-generated fields
-    # For now, let's just exclude the PK and 'id' if named differently
-    exclude = {pk_col, 'created_at', 'updated_at'}
-    clean_data = {k: v for k, v in record_dict.items() if k not in exclude and v is not None}
-    
-    create_record(table_name, clean_data)
+    audit.record_changes(table_name, pk_col, 'insert', records)
+    return records
+
+def _group_batch(columns, records, key_cols=(), generated=()):
+    """
+    Validates a batch against the table's columns and groups the accepted
+    records by column set, so each group can be written with one statement.
+    Records must set every `key_cols` column and none of `generated`.
+    Returns ({column tuple: [value tuples]}, [rejected entries]).
+    """
+    col_names = {c['name'] for c in columns}
+    groups = {}
+    rejected = []
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            rejected.append({"index": i, "error": "Record must be an object"})
+            continue
+        unknown = [k for k in record if k not in col_names]
+        if unknown:
+            rejected.append({"index": i, "error": f"Unknown columns: {', '.join(unknown)}"})
+            continue
+        clean_data = {k: v for k, v in record.items() if v is not None}
+        if not clean_data:
+            rejected.append({"index": i, "error": "No valid data provided"})
+            continue
+        missing = [c for c in key_cols if c not in clean_data]
+        if missing:
+            rejected.append({"index": i, "error": f"Missing primary key '{', '.join(missing)}'"})
+            continue
+        assigned = [c for c in generated if c in clean_data]
+        if assigned:
+            rejected.append({"index": i, "error": f"'{', '.join(assigned)}' is generated and cannot be set"})
+            continue
+        key = tuple(sorted(clean_data))
+        groups.setdefault(key, []).append(tuple(clean_data[c] for c in key))
+    return groups, rejected
+
+def _history_suffix(details):
+    # Written rows are only returned when record history needs them.
+    return f' RETURNING {_column_list(details)}' if audit.RECORD_HISTORY else ''
+
+def bulk_insert(table_name, records):
+    """Multi-row INSERT of a batch of records in a single transaction."""
+    details = _get_writable_columns(table_name)
+    groups, rejected = _group_batch(details, records,
+                                    generated=_generated_columns(table_name, get_primary_key(details)))
+
+    inserted = 0
+    written = []
+    with transaction() as conn:
+        cur = conn.cursor()
+        for cols, rows in groups.items():
+            col_str = ", ".join([f'"{c}"' for c in cols])
+            result = execute_values(cur, f'INSERT INTO app."{table_name}" ({col_str}) VALUES %s' + _history_suffix(details),
+                                    rows, page_size=BULK_PAGE_SIZE, fetch=audit.RECORD_HISTORY)
+            if result:
+                written.extend(_row_dict(cur, row) for row in result)
+            inserted += len(rows)
+        cur.close()
+
+    audit.record_changes(table_name, get_primary_key(details), 'insert', written)
+    return {"inserted": inserted, "rejected": rejected}
+
+def bulk_upsert(table_name, records):
+    """Multi-row INSERT ... ON CONFLICT (pk) DO UPDATE in a single transaction."""
+    details = _get_writable_columns(table_name)
+    pk_col = _require_pk(details)
+    if _generated_columns(table_name, pk_col):
+        raise ValueError("Partitioned objects generate their ids and do not support upserts")
+    key_cols = [pk_col]
+    groups, rejected = _group_batch(details, records, key_cols=key_cols)
+
+    upserted = 0
+    written = []
+    with transaction() as conn:
+        cur = conn.cursor()
+        for cols, rows in groups.items():
+            # ON CONFLICT cannot touch the same row twice in one statement,
+            # so the last record for each key wins.
+            key_idx = [cols.index(c) for c in key_cols]
+            rows = list({tuple(row[i] for i in key_idx): row for row in rows}.values())
+
+            col_str = ", ".join([f'"{c}"' for c in cols])
+            updates = [f'"{c}" = EXCLUDED."{c}"' for c in cols if c not in key_cols]
+            action = f'DO UPDATE SET {", ".join(updates)}' if updates else 'DO NOTHING'
+            conflict = ", ".join([f'"{c}"' for c in key_cols])
+            result = execute_values(cur,
+                                    f'INSERT INTO app."{table_name}" ({col_str}) VALUES %s '
+                                    f'ON CONFLICT ({conflict}) {action}' + _history_suffix(details),
+                                    rows, page_size=BULK_PAGE_SIZE, fetch=audit.RECORD_HISTORY)
+            if result:
+                written.extend(_row_dict(cur, row) for row in result)
+            upserted += len(rows)
+        cur.close()
+
+    audit.record_changes(table_name, pk_col, 'upsert', written)
+    return {"upserted": upserted, "rejected": rejected}
+
+def bulk_delete(table_name, record_ids):
+    """DELETE a list of primary keys with a single statement."""
+    details = _get_writable_columns(table_name)
+    pk_col = _require_pk(details)
+    # With the modifier: a bare character[] cast cuts char(n) ids to one character.
+    pk_type = next(c['sql_type'] for c in details if c['name'] == pk_col)
+
+    if not isinstance(record_ids, list):
+        raise ValueError("Expected a list of ids")
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(f'DELETE FROM app."{table_name}" WHERE "{pk_col}" = ANY(%s::{pk_type}[])' + _history_suffix(details),
+                    (record_ids,))
+        deleted = cur.rowcount
+        written = [_row_dict(cur, row) for row in cur.fetchall()] if audit.RECORD_HISTORY else []
+        cur.close()
+
+    audit.record_changes(table_name, pk_col, 'delete', written)
+
+    return {"deleted": deleted, "requested": len(record_ids)}
+
+def copy_records(table_name, stream):
+    """
+    Loads a CSV upload (header row first) with COPY FROM STDIN. The header
+    is validated once; COPY is all-or-nothing, so any bad row fails the batch.
+    """
+    details = _get_writable_columns(table_name)
+    col_names = {c['name'] for c in details}
+
+    header_line = stream.readline()
+    if isinstance(header_line, bytes):
+        header_line = header_line.decode('utf-8')
+    header = next(csv.reader([header_line]), [])
+    if not header:
+        raise ValueError("CSV upload must start with a header row")
+    unknown = [h for h in header if h not in col_names]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    generated = _generated_columns(table_name, get_primary_key(details)) & set(header)
+    if generated:
+        raise ValueError(f"'{', '.join(sorted(generated))}' is generated and cannot be set")
+
+    col_str = ", ".join([f'"{c}"' for c in header])
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.copy_expert(f'COPY app."{table_name}" ({col_str}) FROM STDIN WITH (FORMAT csv)', stream)
+        inserted = cur.rowcount
+        cur.close()
+
+    # COPY returns no rows, so a load is recorded as one summary entry.
+    audit.record_changes(table_name, None, 'copy', [{"rows": inserted, "columns": header}])
+    return {"inserted": inserted, "rejected": []}
@@ -0,0 +1,619 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from flask import g, has_request_context
+
+from app import metrics
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every statement's latency and row count to metrics."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - start, self.rowcount)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that tracks its session's server-side prepared statements (see app.prepared)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()  # statement name -> None, least recently used first
+        self.prepared_generation = None
+
+
+def _connect_kwargs():
+    return {
+        "connection_factory": PreparingConnection,
+        "cursor_factory": InstrumentedCursor,
+        "host": os.environ.get('POSTGRES_HOST', 'postgres'),
+        "database": os.environ.get('POSTGRES_DB', 'homeserver'),
+        "user": os.environ.get('POSTGRES_USER', 'homeserver'),
+        "password": os.environ.get('POSTGRES_PASSWORD', 'homeserver_secret'),
+    }
+
+
+def connect_params():
+    """Connection settings as libpq keywords, for drivers other than psycopg2."""
+    params = _connect_kwargs()
+    del params["connection_factory"]
+    del params["cursor_factory"]
+    params["dbname"] = params.pop("database")
+    return params
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with a bounded size, checkout
+    timeouts and a health check on checkout.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, check_after, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []  # list of (conn, returned_at)
+        self._in_use = set()
+        self._pending = 0
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "wait_time_total": 0.0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._stats["connects"] += 1
+        return conn
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Only round-trip to the server for connections that sat idle long
+        # enough for the server or a firewall to have dropped them.
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reserve(self, deadline):
+        """Takes an idle connection or a slot for a new one, waiting if needed."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use.add(conn)
+                    return conn, returned_at
+                if self._size() < self.maxconn:
+                    self._pending += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Timed out after {self.timeout}s waiting for a database connection"
+                    )
+                self._cond.wait(remaining)
+
+    def getconn(self):
+        """Check out a healthy connection, waiting up to `timeout` seconds."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            conn, returned_at = self._reserve(deadline)
+            if conn is None:
+                # Connect outside the lock so slow handshakes don't stall
+                # threads that could be served from the idle list.
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._pending -= 1
+                        if conn is not None:
+                            self._in_use.add(conn)
+                        self._cond.notify()
+            elif not self._healthy(conn, returned_at):
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["wait_time_total"] += waited
+            metrics.record_pool_wait(waited)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is broken."""
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self._cond:
+            self._in_use.discard(conn)
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+            })
+            return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.environ.get('DB_POOL_MIN', 1)),
+                    maxconn=int(os.environ.get('DB_POOL_MAX', 10)),
+                    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+                    check_after=float(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+                    **_connect_kwargs()
+                )
+    return _pool
+
+
+def close_pool():
+    """Closes the process-wide pools; the next get_pool() opens a new one."""
+    global _pool, _replicas
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        for replica in _replicas or ():
+            replica.pool.closeall()
+        _replicas = None
+
+
+# --- Read replicas ---
+#
+# With DB_REPLICAS set (comma-separated libpq DSNs or URLs; settings they
+# omit come from the POSTGRES_* variables), read-only requests are served
+# from a streaming replica. A background thread checks every replica each
+# DB_REPLICA_CHECK_INTERVAL seconds; replicas that are unreachable, not in
+# recovery or more than DB_REPLICA_MAX_LAG seconds behind get no reads
+# until they recover. Without a healthy replica reads use the primary.
+
+REPLICA_DSNS = [dsn.strip() for dsn in os.environ.get('DB_REPLICAS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
+# How long a client reads from the primary after a write (see app.main),
+# long enough for any replica still in rotation to have replayed it.
+PRIMARY_PIN = float(os.environ.get('DB_PRIMARY_PIN', REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL))
+
+# Replay lag in seconds; 0 when everything received has been replayed, so an
+# idle primary does not make its replicas look stale.
+REPLICA_LAG_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() IS NOT DISTINCT FROM pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END::float8
+"""
+
+
+class Replica:
+    """A read replica's pool and its last health check."""
+
+    def __init__(self, dsn):
+        params = psycopg2.extensions.parse_dsn(dsn)
+        connect_kwargs = _connect_kwargs()
+        if "dbname" in params:
+            del connect_kwargs["database"]
+        connect_kwargs.update(params)
+        connect_kwargs.setdefault("connect_timeout", 3)
+        self.name = f"{connect_kwargs.get('host', 'localhost')}:{connect_kwargs.get('port', 5432)}"
+        # minconn=0 so an unreachable replica never blocks startup.
+        self.pool = ConnectionPool(
+            minconn=0,
+            maxconn=int(os.environ.get('DB_REPLICA_POOL_MAX', os.environ.get('DB_POOL_MAX', 10))),
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            check_after=float(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+            **connect_kwargs
+        )
+        self.healthy = False
+        self.lag = None
+        self.error = None
+
+    def check(self):
+        conn = None
+        broken = False
+        try:
+            conn = self.pool.getconn()
+            cur = conn.cursor()
+            cur.execute(REPLICA_LAG_QUERY)
+            in_recovery, lag = cur.fetchone()
+            cur.close()
+            conn.rollback()
+        except (psycopg2.Error, PoolTimeout) as e:
+            broken = True
+            self.healthy, self.lag, self.error = False, None, str(e).strip()
+            return
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn, close=broken)
+        self.lag = lag
+        if not in_recovery:
+            self.healthy, self.error = False, "not a standby"
+        elif lag > REPLICA_MAX_LAG:
+            self.healthy, self.error = False, f"lagging {lag:.1f}s"
+        else:
+            self.healthy, self.error = True, None
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats.update({"name": self.name, "healthy": self.healthy, "lag": self.lag, "error": self.error})
+        return stats
+
+
+_replicas = None
+_replica_checker = None
+_replica_turn = itertools.count()
+
+
+def get_replicas():
+    """The configured replicas (empty without DB_REPLICAS)."""
+    global _replicas
+    if _replicas is None and REPLICA_DSNS:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = [Replica(dsn) for dsn in REPLICA_DSNS]
+    return _replicas or []
+
+
+def _ensure_replica_checker():
+    global _replica_checker
+    if _replica_checker is not None and _replica_checker.is_alive():
+        return
+    with _pool_lock:
+        if _replica_checker is None or not _replica_checker.is_alive():
+            _replica_checker = threading.Thread(target=_check_replicas_loop, name="replica-check", daemon=True)
+            _replica_checker.start()
+
+
+def _check_replicas_loop():
+    while True:
+        for replica in get_replicas():
+            replica.check()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+def pick_replica():
+    """A healthy replica, round-robin, or None to read from the primary."""
+    replicas = get_replicas()
+    if not replicas:
+        return None
+    _ensure_replica_checker()
+    healthy = [r for r in replicas if r.healthy]
+    if not healthy:
+        return None
+    return healthy[next(_replica_turn) % len(healthy)]
+
+
+def mark_replica_down(replica, error):
+    """Takes a replica out of rotation until its next successful check."""
+    replica.healthy = False
+    replica.error = str(error).strip()
+
+
+_inherited = []
+
+
+def _reset_after_fork():
+    # A forked worker must not share the parent's sockets. The inherited
+    # pools are only dereferenced, never closed: closing would also end the
+    # parent's sessions on the server.
+    global _pool, _pool_lock, _replicas, _replica_checker
+    if _pool is not None:
+        _inherited.append(_pool)
+    _inherited.extend(r.pool for r in _replicas or ())
+    _pool = None
+    _pool_lock = threading.Lock()
+    _replicas = None
+    _replica_checker = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def checkout():
+    """
+    Checks a dedicated connection out of the pool for the duration of the
+    block, independent of any request unit of work. Callers commit
+    explicitly; anything left uncommitted is rolled back when the
+    connection is returned.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+
+# --- Request unit of work ---
+#
+# While a request is active, connection() and transaction() share a single
+# pooled connection stored on flask.g, checked out lazily on first use.
+# Everything the request does runs in one transaction. commit_unit_of_work()
+# commits it before the response is sent, so a failed commit still becomes
+# an error response; end_unit_of_work() returns the connection (rolling back
+# after a failure). In a read-only unit of work, connection() reads from a
+# replica when one is healthy.
+
+def _unit_of_work():
+    return has_request_context() and g.get('db_unit_of_work', False)
+
+
+def begin_unit_of_work(read_only=False):
+    g.db_unit_of_work = True
+    g.db_read_only = read_only
+    g.db_conn = None
+    g.db_replica = None
+    g.db_rollback_only = False
+    g.db_broken = False
+    g.db_after_commit = []
+
+
+def commit_unit_of_work():
+    """
+    Commits the request's writes now. Raises the database error if the
+    commit fails (connection lost, serialization failure), after which the
+    unit of work only rolls back.
+    """
+    if not _unit_of_work() or g.db_conn is None or g.db_rollback_only or g.db_broken:
+        return
+    try:
+        g.db_conn.commit()
+    except psycopg2.Error:
+        g.db_rollback_only = True
+        g.db_broken = bool(g.db_conn.closed)
+        raise
+
+
+def end_unit_of_work(exc=None):
+    """
+    Returns the request's connection, committing anything not yet committed
+    unless the request failed. A failed commit is raised, not swallowed.
+    """
+    if not g.get('db_unit_of_work', False):
+        return
+    conn = g.db_conn
+    replica = g.get('db_replica')
+    callbacks = g.get('db_after_commit', [])
+    g.db_unit_of_work = False
+    g.db_conn = None
+    g.db_replica = None
+    g.db_after_commit = []
+    if conn is None:
+        return
+
+    broken = g.db_broken
+    commit = exc is None and not g.db_rollback_only and not broken
+    try:
+        if commit:
+            conn.commit()
+        elif not broken:
+            conn.rollback()
+    except psycopg2.Error:
+        if not commit:
+            broken = True
+        else:
+            broken = bool(conn.closed)
+            raise
+    finally:
+        (replica.pool if replica is not None else get_pool()).putconn(conn, close=broken)
+
+    if commit:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: after-commit callback failed: {e}")
+
+
+def after_commit(callback):
+    """
+    Runs `callback` once the current writes are committed: at the end of the
+    request inside a unit of work (dropped on rollback), immediately otherwise.
+    Call it after the transaction() block that made the writes.
+    """
+    if _unit_of_work():
+        g.db_after_commit.append(callback)
+    else:
+        callback()
+
+
+def release_request_connection():
+    """
+    Finishes the request's transaction early and returns its connection,
+    for statements such as CREATE INDEX CONCURRENTLY that wait for every
+    open transaction to end. Later calls check out a fresh connection.
+    """
+    if _unit_of_work() and g.db_conn is not None:
+        read_only = g.db_read_only
+        end_unit_of_work()
+        begin_unit_of_work(read_only)
+
+
+def _request_connection(primary):
+    if g.db_conn is None:
+        replica = None if primary or not g.db_read_only else pick_replica()
+        if replica is not None:
+            try:
+                g.db_conn = replica.pool.getconn()
+                g.db_replica = replica
+            except (psycopg2.OperationalError, PoolTimeout) as e:
+                mark_replica_down(replica, e)
+        if g.db_conn is None:
+            g.db_conn = get_pool().getconn()
+    return g.db_conn
+
+
+@contextmanager
+def connection(primary=False):
+    """
+    Connection for reads. Inside a request this is the request's shared
+    connection; otherwise a pooled connection for the duration of the block.
+    `primary=True` is for reads that must see the latest commits (or that
+    write): if the request already reads from a replica, the block gets its
+    own primary connection, committed when the block succeeds.
+    """
+    if not _unit_of_work():
+        with checkout() as conn:
+            yield conn
+        return
+    if primary and g.db_replica is not None:
+        with checkout() as conn:
+            yield conn
+            conn.commit()
+        return
+
+    conn = _request_connection(primary)
+    try:
+        yield conn
+    except psycopg2.OperationalError as e:
+        g.db_broken = True
+        if g.db_replica is not None and conn.closed:
+            mark_replica_down(g.db_replica, e)
+        raise
+    except Exception:
+        g.db_rollback_only = True
+        raise
+
+
+@contextmanager
+def transaction():
+    """
+    Connection for writes that commit together. Outside a request the block
+    is committed on success and rolled back on error; inside a request the
+    commit is deferred to the end of the request.
+    """
+    with connection(primary=True) as conn:
+        if _unit_of_work() and g.db_replica is None:
+            yield conn
+            return
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+
+def connect_direct():
+    """
+    Opens a dedicated, unpooled autocommit connection for long-lived
+    consumers such as LISTEN loops.
+    """
+    conn = psycopg2.connect(**_connect_kwargs())
+    conn.autocommit = True
+    return conn
+
+
+def pool_stats():
+    if _pool is None:
+        return None
+    return _pool.stats()
+
+
+def replica_stats():
+    if _replicas is None:
+        return None
+    return [replica.stats() for replica in _replicas]
@@ -1,38 +1,404 @@
-import psycopg2
 import os
 import re
+import psycopg2
+from app.db import checkout, release_request_connection
+from app import audit, catalog, partitions
+
+MANAGED_INDEX_PREFIX = 'ix_'
+CHANGES_CHANNEL = 'record_changes'
+DERIVED_ROLE = 'homeserver_derived'
+CHANGE_TRIGGERS = ('homeserver_changes_insert', 'homeserver_changes_update', 'homeserver_changes_delete')
+FORBIDDEN_KEYWORDS = ['DROP ', 'TRUNCATE ', 'GRANT ', 'REVOKE ', 'ALTER ', 'COPY ', 'INSERT ', 'UPDATE ', 'DELETE ']
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.environ['POSTGRES_HOST'],
-        database=os.environ['POSTGRES_DB'],
-        user=os.environ['POSTGRES_USER'],
-        password=os.environ['POSTGRES_PASSWORD']
-    )
+# Text search configuration for the generated search column and queries.
+SEARCH_CONFIG = os.environ.get('SEARCH_CONFIG', 'simple')
+if not re.match(r'^[a-z_]+$', SEARCH_CONFIG):
+    raise ValueError(f"Invalid SEARCH_CONFIG '{SEARCH_CONFIG}'")
 
 def init_db():
     """Idempotent initialization of schemas and audit table."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Create schemas
-    cur.execute("CREATE SCHEMA IF NOT EXISTS app;")
-    cur.execute("CREATE SCHEMA IF NOT EXISTS internal;")
-    
-    # Create Audit Table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS internal.ddl_audit (
-            id SERIAL PRIMARY KEY,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            sql_text TEXT NOT NULL,
-            success BOOLEAN DEFAULT FALSE,
-            error_message TEXT
-        );
+    with checkout() as conn:
+        cur = conn.cursor()
+
+        # Create schemas
+        cur.execute("CREATE SCHEMA IF NOT EXISTS app;")
+        cur.execute("CREATE SCHEMA IF NOT EXISTS internal;")
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {partitions.ARCHIVE_SCHEMA};")
+
+        # Create Audit Table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.ddl_audit (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sql_text TEXT NOT NULL,
+                success BOOLEAN DEFAULT FALSE,
+                error_message TEXT
+            );
+        """)
+
+        # Record-level change history written by the audit writer
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.record_history (
+                id BIGSERIAL PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                record_pk TEXT,
+                operation TEXT NOT NULL,
+                data JSONB,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS record_history_record
+            ON internal.record_history (table_name, record_pk, id);
+        """)
+
+        # Filter/sort column usage recorded by the index advisor
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.column_usage (
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                calls BIGINT NOT NULL DEFAULT 0,
+                total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (table_name, column_name, usage)
+            );
+        """)
+
+        # Prompt -> DDL cache for the LLM generator
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.llm_ddl_cache (
+                prompt_hash TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                ddl TEXT NOT NULL,
+                hits BIGINT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Background object-creation jobs
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.object_jobs (
+                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                prompt TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                sql_text TEXT,
+                table_name TEXT,
+                error TEXT,
+                cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS object_jobs_active_prompt
+            ON internal.object_jobs (prompt_hash) WHERE status IN ('queued', 'running');
+        """)
+
+        # Derived objects: materialized views in the app schema, their
+        # sources and refresh policy (see app.derived). source_versions holds
+        # the sources' table_versions as of the last refresh.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.derived_objects (
+                view_name TEXT PRIMARY KEY,
+                sql_text TEXT NOT NULL,
+                key_column TEXT NOT NULL,
+                source_tables TEXT[] NOT NULL DEFAULT '{}',
+                source_versions JSONB NOT NULL DEFAULT '{}',
+                refresh_interval DOUBLE PRECISION,
+                change_threshold BIGINT,
+                refreshed_at TIMESTAMP,
+                refresh_ms DOUBLE PRECISION,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Partitioning policy of time-partitioned objects (see app.partitions)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.partitioned_objects (
+                table_name TEXT PRIMARY KEY,
+                partition_column TEXT NOT NULL,
+                partition_interval TEXT NOT NULL,
+                premake INTEGER NOT NULL,
+                retention INTERVAL,
+                retention_action TEXT NOT NULL DEFAULT 'detach',
+                last_maintained_at TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Per-table change versions, bumped by a statement-level trigger on
+        # every app table and used for ETags and response caching.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.table_versions (
+                table_name TEXT PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION internal.bump_table_version()
+            RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                INSERT INTO internal.table_versions (table_name, version, changed_at)
+                VALUES (TG_TABLE_NAME, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (table_name) DO UPDATE
+                SET version = internal.table_versions.version + 1,
+                    changed_at = CURRENT_TIMESTAMP;
+                RETURN NULL;
+            END;
+            $$;
+        """)
+
+        # Row-level change events for the SSE change feed (app/changes.py),
+        # recorded only for tables listed in change_feeds (the feed is opt-in,
+        # as it copies every written row). One NOTIFY per transaction and
+        # table carries the transaction id, so listeners read exactly the
+        # events that committed.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.change_feeds (
+                table_name TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS internal.change_events (
+                id BIGSERIAL PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                record_pk TEXT,
+                data JSONB,
+                txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS change_events_table_id
+            ON internal.change_events (table_name, id);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS change_events_txid
+            ON internal.change_events (txid);
+        """)
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION internal.record_change_events()
+            RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO internal.change_events (table_name, operation, record_pk, data)
+                    SELECT TG_TABLE_NAME, 'delete', to_jsonb(o) ->> TG_ARGV[0], to_jsonb(o) - '{catalog.SEARCH_COLUMN}'
+                    FROM old_rows o;
+                ELSE
+                    INSERT INTO internal.change_events (table_name, operation, record_pk, data)
+                    SELECT TG_TABLE_NAME, lower(TG_OP), to_jsonb(n) ->> TG_ARGV[0], to_jsonb(n) - '{catalog.SEARCH_COLUMN}'
+                    FROM new_rows n;
+                END IF;
+                IF FOUND THEN
+                    PERFORM pg_notify('{CHANGES_CHANNEL}', TG_TABLE_NAME || ':' || pg_current_xact_id()::text);
+                END IF;
+                RETURN NULL;
+            END;
+            $$;
+        """)
+
+        # Bring every table's triggers in line with its change feed setting.
+        cur.execute("""
+            SELECT c.relname,
+                   EXISTS (SELECT 1 FROM pg_trigger t
+                           WHERE t.tgrelid = c.oid AND t.tgname = 'homeserver_version'),
+                   (SELECT count(*) FROM pg_trigger t
+                    WHERE t.tgrelid = c.oid AND t.tgname = ANY(%s)),
+                   EXISTS (SELECT 1 FROM internal.change_feeds f WHERE f.table_name = c.relname)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'app' AND c.relkind IN ('r', 'p') AND NOT c.relispartition;
+        """, (list(CHANGE_TRIGGERS),))
+        for table_name, versioned, change_triggers, feed in cur.fetchall():
+            if not versioned:
+                install_table_triggers(cur, table_name)
+            if feed and change_triggers < len(CHANGE_TRIGGERS):
+                install_change_triggers(cur, table_name)
+            elif not feed and change_triggers:
+                drop_change_triggers(cur, table_name)
+
+        conn.commit()
+
+        # Broadcast schema changes made outside the app (psql, migrations) to
+        # every worker's schema catalog. Event triggers need superuser, so
+        # this is best effort; execute_ddl notifies explicitly either way.
+        try:
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION internal.notify_schema_change()
+                RETURNS event_trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    -- Refreshing a derived object changes no columns.
+                    IF tg_tag <> 'REFRESH MATERIALIZED VIEW' THEN
+                        PERFORM pg_notify('schema_changed', tg_tag);
+                    END IF;
+                END;
+                $$;
+            """)
+            cur.execute("SELECT 1 FROM pg_event_trigger WHERE evtname = 'homeserver_schema_changed'")
+            if not cur.fetchone():
+                cur.execute("""
+                    CREATE EVENT TRIGGER homeserver_schema_changed ON ddl_command_end
+                    EXECUTE FUNCTION internal.notify_schema_change();
+                """)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Warning: Schema change event trigger not installed: {e}")
+
+        # Derived objects are created as (and so refreshed as) a role that
+        # can only read the app schema. Needs superuser or CREATEROLE.
+        try:
+            cur.execute("SELECT 1 FROM pg_roles WHERE rolname = %s", (DERIVED_ROLE,))
+            if not cur.fetchone():
+                cur.execute(f"CREATE ROLE {DERIVED_ROLE} NOLOGIN")
+            cur.execute(f"GRANT {DERIVED_ROLE} TO CURRENT_USER")
+            cur.execute(f"GRANT USAGE, CREATE ON SCHEMA app TO {DERIVED_ROLE}")
+            cur.execute(f"GRANT SELECT ON ALL TABLES IN SCHEMA app TO {DERIVED_ROLE}")
+            cur.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA app GRANT SELECT ON TABLES TO {DERIVED_ROLE}")
+            # Views created before the role existed are handed over to it.
+            cur.execute("""
+                SELECT c.relname FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'app' AND c.relkind = 'm' AND c.relowner <> %s::regrole
+            """, (DERIVED_ROLE,))
+            for (view_name,) in cur.fetchall():
+                cur.execute(f'ALTER MATERIALIZED VIEW app."{view_name}" OWNER TO {DERIVED_ROLE}')
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Warning: Derived object role not installed: {e}")
+
+        cur.close()
+
+def install_table_triggers(cur, table_name):
+    """Installs the change-tracking trigger on a new app table."""
+    cur.execute(f"""
+        CREATE OR REPLACE TRIGGER homeserver_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON app."{table_name}"
+        FOR EACH STATEMENT EXECUTE FUNCTION internal.bump_table_version();
     """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    # A recreated table must not reuse the version or change feed of its predecessor.
+    cur.execute("""
+        INSERT INTO internal.table_versions (table_name, version) VALUES (%s, 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = internal.table_versions.version + 1,
+                                               changed_at = CURRENT_TIMESTAMP
+    """, (table_name,))
+    cur.execute("DELETE FROM internal.change_feeds WHERE table_name = %s", (table_name,))
+
+def install_change_triggers(cur, table_name):
+    """Installs the change-feed triggers on an app table (see changes.enable)."""
+    # The record key is the first primary key column that is not the
+    # partition column (see catalog).
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY k (attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        LEFT JOIN pg_partitioned_table pt ON pt.partrelid = i.indrelid
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        AND NOT COALESCE(k.attnum = ANY(pt.partattrs), FALSE)
+        ORDER BY k.ord
+        LIMIT 1;
+    """, (f'app."{table_name}"',))
+    row = cur.fetchone()
+    pk_col = row[0].replace("'", "''") if row else ''
+    # Transition tables need one trigger per event.
+    for event, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                              ('UPDATE', 'NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows')):
+        cur.execute(f"""
+            CREATE OR REPLACE TRIGGER homeserver_changes_{event.lower()}
+            AFTER {event} ON app."{table_name}"
+            REFERENCING {transition}
+            FOR EACH STATEMENT EXECUTE FUNCTION internal.record_change_events('{pk_col}');
+        """)
+
+def drop_change_triggers(cur, table_name):
+    for trigger in CHANGE_TRIGGERS:
+        cur.execute(f'DROP TRIGGER IF EXISTS {trigger} ON app."{table_name}"')
+
+def search_text_sql(text_columns):
+    """Concatenation of the given text columns, NULLs as empty strings."""
+    return " || ' ' || ".join([f"coalesce(\"{c}\", '')" for c in text_columns])
+
+def search_document_sql(text_columns):
+    """tsvector expression over the given text columns (immutable, so it can be a generated column)."""
+    return f"to_tsvector('{SEARCH_CONFIG}'::regconfig, {search_text_sql(text_columns)})"
+
+def install_search(cur, table_name):
+    """
+    (Re)creates the generated tsvector column over all text columns of an
+    app table, with a GIN index. Postgres keeps the column current on every
+    write. Returns False if the table has no text columns.
+    """
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        AND a.attgenerated = '' AND format_type(a.atttypid, NULL) = ANY(%s)
+        ORDER BY a.attnum;
+    """, (f'app."{table_name}"', list(catalog.TEXT_TYPES)))
+    text_columns = [r[0] for r in cur.fetchall()]
+
+    # Dropping the column also drops its index.
+    cur.execute(f'ALTER TABLE app."{table_name}" DROP COLUMN IF EXISTS "{catalog.SEARCH_COLUMN}"')
+    if not text_columns:
+        return False
+    cur.execute(f'ALTER TABLE app."{table_name}" ADD COLUMN "{catalog.SEARCH_COLUMN}" tsvector '
+                f'GENERATED ALWAYS AS ({search_document_sql(text_columns)}) STORED')
+    index_name = f'search_{table_name}'[:63]
+    cur.execute(f'CREATE INDEX "{index_name}" ON app."{table_name}" USING gin ("{catalog.SEARCH_COLUMN}")')
+    return True
+
+def rebuild_search(table_name):
+    """
+    Installs or refreshes full-text search on an existing app table, e.g.
+    after columns were added outside the app. Rewrites the table under an
+    exclusive lock, so run it at a quiet time on large tables.
+    """
+    if catalog.get_columns(table_name) is None:
+        raise ValueError("Table does not exist")
+    if catalog.is_derived(table_name):
+        raise ValueError("Derived objects cannot be searched")
+    sql = f'ALTER TABLE app."{table_name}" ADD COLUMN "{catalog.SEARCH_COLUMN}" ... -- rebuild full-text search'
+    release_request_connection()
+    with checkout() as conn:
+        cur = conn.cursor()
+        try:
+            installed = install_search(cur, table_name)
+            cur.execute("SELECT pg_notify(%s, %s)", (catalog.SCHEMA_CHANNEL, 'ALTER TABLE'))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            audit.record_ddl(sql, False, str(e))
+            raise
+        finally:
+            cur.close()
+    catalog.invalidate()
+    audit.record_ddl(sql, True)
+    return installed
+
+PARTITION_BY_RE = re.compile(r'\bPARTITION\s+BY\s+RANGE\s*\(\s*"?([a-zA-Z0-9_]+)"?\s*\)\s*$', re.IGNORECASE)
+
+def partition_column_from_ddl(statement):
+    """The range-partition column of a validated CREATE TABLE, or None."""
+    match = PARTITION_BY_RE.search(statement)
+    return match.group(1).lower() if match else None
+
+def table_name_from_ddl(statement):
+    """Returns the app table name from a validated CREATE TABLE statement."""
+    # Unquoted identifiers are folded to lower case by Postgres.
+    return re.match(r'^CREATE\s+TABLE\s+app\.([a-zA-Z0-9_]+)', statement, re.IGNORECASE).group(1).lower()
 
 def validate_ddl(sql: str):
     """
@@ -65,66 +431,257 @@ def validate_ddl(sql: str):
         raise ValueError("Statement must start with 'CREATE TABLE app.<name>'")
         
     # 4. Check forbidden keywords (DROP, TRUNCATE, GRANT, etc) - simple safeguards
-    forbidden = ['DROP ', 'TRUNCATE ', 'GRANT ', 'REVOKE ', 'ALTER ', 'COPY ', 'INSERT ', 'UPDATE ', 'DELETE ']
     upper_sql = statement.upper()
-    for verb in forbidden:
+    for verb in FORBIDDEN_KEYWORDS:
         if verb in upper_sql:
             raise ValueError(f"Operation '{verb.strip()}' is not allowed.")
 
     # 5. Check for Primary Key
     if 'PRIMARY KEY' not in upper_sql:
         raise ValueError("Table definition must include a PRIMARY KEY.")
+
+    # 6. Partitioning: only time ranges, declared last; partitions themselves
+    # are created by app.partitions.
+    if re.search(r'\bPARTITION\s+OF\b', upper_sql) or \
+            (re.search(r'\bPARTITION\s+BY\b', upper_sql) and not PARTITION_BY_RE.search(statement)):
+        raise ValueError("Only 'PARTITION BY RANGE (<date or timestamp column>)' at the end is allowed.")
         
     return statement
 
 def execute_ddl(sql: str):
     """Validates and executes DDL, logging result to audit table."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    success = False
-    error_msg = None
-    
-    try:
-        # Validate
-        clean_sql = validate_ddl(sql)
-        
-        # Execute DDL
-        cur.execute(clean_sql)
-        success = True
-        
-    except Exception as e:
-        error_msg = str(e)
-        raise e # Re-raise to let caller know
-    finally:
-        # Audit Log (in separate transaction block or same? strictly same if we want atomic, 
-        # but for DDL in Postgres, DDL is transactional. 
-        # However, if DDL fails, we still want to log the failure. 
-        # So we rollback the DDL transaction and then insert audit log.)
-        
-        if success:
-             conn.commit()
-             # Log success
-             try:
-                 audit_conn = get_db_connection()
-                 audit_cur = audit_conn.cursor()
-                 audit_cur.execute("INSERT INTO internal.ddl_audit (sql_text, success) VALUES (%s, %s)", (sql, True))
-                 audit_conn.commit()
-                 audit_conn.close()
-             except:
-                 pass # Don't fail main flow if audit fails on success logging?
-                 
-        else:
-             conn.rollback() # Rollback the failed DDL
-             # Log Error
-             try:
-                 audit_conn = get_db_connection()
-                 audit_cur = audit_conn.cursor()
-                 audit_cur.execute("INSERT INTO internal.ddl_audit (sql_text, success, error_message) VALUES (%s, %s, %s)", (sql, False, error_msg))
-                 audit_conn.commit()
-                 audit_conn.close()
-             except Exception as audit_e:
-                 print(f"Failed to write audit log: {audit_e}")
-
-    cur.close()
-    conn.close()
+    with checkout() as conn:
+        cur = conn.cursor()
+
+        success = False
+        error_msg = None
+
+        try:
+            # Validate
+            clean_sql = validate_ddl(sql)
+
+            # Execute DDL
+            cur.execute(clean_sql)
+            table_name = table_name_from_ddl(clean_sql)
+            install_table_triggers(cur, table_name)
+            install_search(cur, table_name)
+            partition_column = partition_column_from_ddl(clean_sql)
+            if partition_column:
+                partitions.register(cur, table_name, partition_column)
+            # Delivered on commit, so other workers only reload a committed schema.
+            cur.execute("SELECT pg_notify(%s, %s)", (catalog.SCHEMA_CHANNEL, 'CREATE TABLE'))
+            success = True
+
+        except Exception as e:
+            error_msg = str(e)
+            raise e # Re-raise to let caller know
+        finally:
+            # DDL in Postgres is transactional, so commit or roll back the DDL
+            # first; the audit row is queued for the batched audit writer, so
+            # a failed DDL is still logged.
+            cur.close()
+            if success:
+                 conn.commit()
+                 catalog.invalidate()
+            else:
+                 conn.rollback() # Rollback the failed DDL
+            audit.record_ddl(sql, success, error_msg)
+
+def validate_view_ddl(sql: str):
+    """
+    Validates a derived-object definition. Only this form is allowed:
+        CREATE MATERIALIZED VIEW app.<name> AS SELECT ... | WITH ...
+    The checks here are a first filter. execute_view_ddl runs the statement
+    as DERIVED_ROLE, which can only read app tables, and checks the view's
+    dependencies. Returns (statement, view_name).
+    """
+    statement = sql.strip().rstrip(';').strip()
+    if ';' in statement:
+        raise ValueError("Must be exactly one statement.")
+
+    match = re.match(r'^CREATE\s+MATERIALIZED\s+VIEW\s+app\.([a-zA-Z0-9_]+)\s+AS\s+(?:SELECT|WITH)\b',
+                     statement, re.IGNORECASE)
+    if not match:
+        raise ValueError("Statement must start with 'CREATE MATERIALIZED VIEW app.<name> AS SELECT'")
+
+    upper_sql = statement.upper()
+    for verb in FORBIDDEN_KEYWORDS:
+        if verb in upper_sql:
+            raise ValueError(f"Operation '{verb.strip()}' is not allowed.")
+    # Server-side file, session and remote-access functions.
+    function = re.search(r'\b(pg_\w+|lo_\w+|dblink\w*|set_config|current_setting)\s*\(', statement, re.IGNORECASE)
+    if function:
+        raise ValueError(f"Function '{function.group(1)}' is not allowed.")
+    return statement, match.group(1).lower()
+
+def view_sources(cur, view_name):
+    """
+    Relations a materialized view reads. Raises if it depends on anything
+    outside the app schema or on user-defined functions.
+    """
+    cur.execute("""
+        SELECT DISTINCT d.refclassid = 'pg_proc'::regclass, n.nspname, c.relname
+        FROM pg_rewrite r
+        JOIN pg_depend d ON d.classid = 'pg_rewrite'::regclass AND d.objid = r.oid
+        LEFT JOIN pg_class c ON d.refclassid = 'pg_class'::regclass AND c.oid = d.refobjid
+        LEFT JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE r.ev_class = %s::regclass
+        AND (d.refclassid = 'pg_proc'::regclass OR (c.oid IS NOT NULL AND c.oid <> r.ev_class))
+    """, (f'app."{view_name}"',))
+    sources = []
+    for is_function, schema, relation in cur.fetchall():
+        if is_function:
+            raise ValueError("Derived objects cannot call user-defined functions")
+        if schema != 'app':
+            raise ValueError(f"Derived objects can only read from the 'app' schema, not '{schema}.{relation}'")
+        sources.append(relation)
+    return sorted(sources)
+
+def execute_view_ddl(sql: str, key_column, refresh_interval=None, change_threshold=None):
+    """
+    Validates and creates a derived object, logging the result to the audit
+    table. `key_column` must be unique in the view; it gets the unique index
+    that REFRESH ... CONCURRENTLY requires. The view is refreshed every
+    `refresh_interval` seconds and/or once its sources have seen
+    `change_threshold` write statements. Returns the view name.
+    """
+    with checkout() as conn:
+        cur = conn.cursor()
+
+        success = False
+        error_msg = None
+
+        try:
+            clean_sql, view_name = validate_view_ddl(sql)
+            if not key_column or not re.match(r'^[a-zA-Z0-9_]+$', str(key_column)):
+                raise ValueError("A key column (a unique column of the view) is required")
+            refresh_interval = float(refresh_interval) if refresh_interval is not None else None
+            change_threshold = int(change_threshold) if change_threshold is not None else None
+            if (refresh_interval is not None and refresh_interval <= 0) or \
+                    (change_threshold is not None and change_threshold <= 0):
+                raise ValueError("refresh_interval and change_threshold must be positive")
+
+            cur.execute("SELECT pg_has_role(%s, 'MEMBER') FROM pg_roles WHERE rolname = %s",
+                        (DERIVED_ROLE, DERIVED_ROLE))
+            row = cur.fetchone()
+            if not row or not row[0]:
+                raise ValueError(f"Derived objects need the '{DERIVED_ROLE}' role (see init_db)")
+            # The view belongs to the restricted role, so its query (e.g. a
+            # query_to_xml call) can't read outside app, now or on refresh.
+            cur.execute(f"SET LOCAL ROLE {DERIVED_ROLE}")
+            cur.execute(clean_sql)
+            cur.execute("RESET ROLE")
+            sources = view_sources(cur, view_name)
+            cur.execute(f'CREATE UNIQUE INDEX "{(view_name + "_key")[:63]}" ON app."{view_name}" ("{key_column}")')
+            cur.execute("""
+                INSERT INTO internal.derived_objects
+                    (view_name, sql_text, key_column, source_tables, source_versions,
+                     refresh_interval, change_threshold, refreshed_at)
+                SELECT %s, %s, %s, %s,
+                       COALESCE((SELECT jsonb_object_agg(v.table_name, v.version)
+                                 FROM internal.table_versions v WHERE v.table_name = ANY(%s)), '{}'),
+                       %s, %s,
+                       CASE WHEN c.relispopulated THEN CURRENT_TIMESTAMP END
+                FROM pg_class c WHERE c.oid = %s::regclass
+            """, (view_name, clean_sql, key_column, sources, sources,
+                  refresh_interval, change_threshold, f'app."{view_name}"'))
+            # Refreshes bump the view's version, which drives its ETags.
+            cur.execute("""
+                INSERT INTO internal.table_versions (table_name, version) VALUES (%s, 1)
+                ON CONFLICT (table_name) DO UPDATE
+                SET version = internal.table_versions.version + 1, changed_at = CURRENT_TIMESTAMP
+            """, (view_name,))
+            cur.execute("SELECT pg_notify(%s, %s)", (catalog.SCHEMA_CHANNEL, 'CREATE MATERIALIZED VIEW'))
+            success = True
+            return view_name
+
+        except Exception as e:
+            error_msg = str(e)
+            raise
+        finally:
+            cur.close()
+            if success:
+                conn.commit()
+                catalog.invalidate()
+            else:
+                conn.rollback()
+            audit.record_ddl(sql, success, error_msg)
+
+def drop_view(view_name):
+    """Drops a derived object. Fails while other derived objects read from it."""
+    if not catalog.is_derived(view_name):
+        raise ValueError("Derived object does not exist")
+    sql = f'DROP MATERIALIZED VIEW app."{view_name}"'
+    with checkout() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+            cur.execute("DELETE FROM internal.derived_objects WHERE view_name = %s", (view_name,))
+            cur.execute("SELECT pg_notify(%s, %s)", (catalog.SCHEMA_CHANNEL, 'DROP MATERIALIZED VIEW'))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            audit.record_ddl(sql, False, str(e))
+            raise
+        finally:
+            cur.close()
+    catalog.invalidate()
+    audit.record_ddl(sql, True)
+
+def validate_index_ddl(sql: str):
+    """
+    Validates a managed-index statement. Only these two forms are allowed:
+        CREATE INDEX CONCURRENTLY [IF NOT EXISTS] ix_<name> ON app.<table> [USING btree] ("col", ...)
+        DROP INDEX CONCURRENTLY [IF EXISTS] app.ix_<name>
+    Returns (statement, index_name).
+    """
+    statement = sql.strip().rstrip(';').strip()
+    if ';' in statement:
+        raise ValueError("Must be exactly one statement.")
+
+    ident = r'"?([a-zA-Z0-9_]+)"?'
+    create = re.match(
+        r'^CREATE\s+INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?' + ident +
+        r'\s+ON\s+app\.' + ident + r'\s*(?:USING\s+btree\s*)?\(\s*("?[a-zA-Z0-9_]+"?(?:\s*,\s*"?[a-zA-Z0-9_]+"?)*)\s*\)$',
+        statement, re.IGNORECASE)
+    drop = re.match(
+        r'^DROP\s+INDEX\s+CONCURRENTLY\s+(?:IF\s+EXISTS\s+)?app\.' + ident + r'$',
+        statement, re.IGNORECASE)
+
+    match = create or drop
+    if not match:
+        raise ValueError("Only 'CREATE INDEX CONCURRENTLY ... ON app.<table> (...)' or "
+                         "'DROP INDEX CONCURRENTLY app.<name>' are allowed")
+    index_name = match.group(1)
+    if not index_name.startswith(MANAGED_INDEX_PREFIX):
+        raise ValueError(f"Managed index names must start with '{MANAGED_INDEX_PREFIX}'")
+    return statement, index_name
+
+def execute_index_ddl(sql: str):
+    """
+    Validates and executes a managed CREATE/DROP INDEX CONCURRENTLY, logging
+    the result to the audit table. CONCURRENTLY cannot run inside a
+    transaction block, so this uses autocommit; a failed concurrent build
+    leaves an INVALID index behind, which is dropped again.
+    """
+    # The concurrent build would wait forever on our own request transaction.
+    release_request_connection()
+    with checkout() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        index_name = None
+        try:
+            clean_sql, index_name = validate_index_ddl(sql)
+            cur.execute(clean_sql)
+            audit.record_ddl(sql, True)
+        except Exception as e:
+            if index_name and clean_sql.upper().startswith('CREATE'):
+                try:
+                    cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS app."{index_name}"')
+                except Exception:
+                    pass
+            audit.record_ddl(sql, False, str(e))
+            raise
+        finally:
+            cur.close()
+            conn.autocommit = False
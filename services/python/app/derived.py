@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+
+from app import catalog, metrics
+from app.db import checkout, connection
+
+# Derived objects are materialized views in the app schema (created through
+# ddl.execute_view_ddl). A background scheduler refreshes each one with
+# REFRESH ... CONCURRENTLY, so reads never block, once its refresh_interval
+# has passed or its source tables have seen change_threshold write
+# statements since the last refresh (counted with internal.table_versions).
+# Every worker runs the scheduler; an advisory lock per view makes sure only
+# one of them refreshes it at a time.
+
+POLL_INTERVAL = float(os.environ.get('DERIVED_POLL_INTERVAL', 10))
+SCHEDULER = os.environ.get('DERIVED_SCHEDULER', '1') != '0'
+
+_thread = None
+_lock = threading.Lock()
+
+metrics.describe('homeserver_derived_refreshes_total', 'counter', 'Derived object refreshes by object and outcome.')
+metrics.describe('homeserver_derived_age_seconds', 'gauge', 'Seconds since a derived object was last refreshed.')
+metrics.describe('homeserver_derived_pending_changes', 'gauge', 'Source write statements since the last refresh.')
+
+# pending_changes sums, over the sources, how far each table's version has
+# moved since the refresh; a view that was never populated is always due.
+STATUS_QUERY = """
+    SELECT view_name, source_tables, key_column, refresh_interval, change_threshold,
+           refreshed_at, age, pending_changes, refresh_ms, last_error,
+           refreshed_at IS NULL
+           OR (refresh_interval IS NOT NULL AND age >= refresh_interval)
+           OR (change_threshold IS NOT NULL AND pending_changes >= change_threshold) AS due
+    FROM (
+        SELECT d.*,
+               EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - d.refreshed_at)::float8 AS age,
+               COALESCE((SELECT sum(GREATEST(v.version - COALESCE((d.source_versions ->> v.table_name)::bigint, 0), 0))
+                         FROM internal.table_versions v
+                         WHERE v.table_name = ANY(d.source_tables)), 0)::bigint AS pending_changes
+        FROM internal.derived_objects d
+    ) s
+"""
+
+STATUS_KEYS = ("name", "sources", "key", "refresh_interval", "change_threshold", "refreshed_at",
+               "age_seconds", "pending_changes", "refresh_ms", "last_error", "due")
+
+
+def _reset_after_fork():
+    global _thread, _lock
+    _thread = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_status(view_name=None):
+    """Refresh policy and staleness of every derived object (or of one)."""
+    with connection() as conn:
+        cur = conn.cursor()
+        if view_name is None:
+            cur.execute(STATUS_QUERY + " ORDER BY view_name")
+        else:
+            cur.execute(STATUS_QUERY + " WHERE view_name = %s", (view_name,))
+        rows = cur.fetchall()
+        cur.close()
+    return [dict(zip(STATUS_KEYS, row)) for row in rows]
+
+
+def refresh(view_name, if_due=False):
+    """
+    Refreshes a derived object now. Returns False without waiting if another
+    process is refreshing it, or with `if_due` if it is no longer due.
+    """
+    if not catalog.is_derived(view_name):
+        raise ValueError("Derived object does not exist")
+    started = time.perf_counter()
+    with checkout() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('derived:' || %s))", (view_name,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return False
+            if if_due:
+                # Another worker may have refreshed it since the caller looked.
+                cur.execute(STATUS_QUERY + " WHERE view_name = %s", (view_name,))
+                row = cur.fetchone()
+                if not row or not row[-1]:
+                    conn.rollback()
+                    return False
+
+            # Source versions are read before the refresh, so changes that
+            # race with it count as pending rather than being missed.
+            cur.execute("""
+                UPDATE internal.derived_objects d
+                SET source_versions = COALESCE((SELECT jsonb_object_agg(v.table_name, v.version)
+                                                FROM internal.table_versions v
+                                                WHERE v.table_name = ANY(d.source_tables)), '{}')
+                WHERE view_name = %s
+            """, (view_name,))
+            cur.execute("SELECT relispopulated FROM pg_class WHERE oid = %s::regclass", (f'app."{view_name}"',))
+            # CONCURRENTLY needs a populated view.
+            concurrently = 'CONCURRENTLY ' if cur.fetchone()[0] else ''
+            cur.execute(f'REFRESH MATERIALIZED VIEW {concurrently}app."{view_name}"')
+            cur.execute("""
+                UPDATE internal.derived_objects
+                SET refreshed_at = CURRENT_TIMESTAMP, refresh_ms = %s, last_error = NULL
+                WHERE view_name = %s
+            """, ((time.perf_counter() - started) * 1000, view_name))
+            cur.execute("""
+                INSERT INTO internal.table_versions (table_name, version) VALUES (%s, 1)
+                ON CONFLICT (table_name) DO UPDATE
+                SET version = internal.table_versions.version + 1, changed_at = CURRENT_TIMESTAMP
+            """, (view_name,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            metrics.inc('homeserver_derived_refreshes_total', object=view_name, outcome='failed')
+            try:
+                cur.execute("UPDATE internal.derived_objects SET last_error = %s WHERE view_name = %s",
+                            (str(e), view_name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+            raise
+        finally:
+            cur.close()
+    metrics.inc('homeserver_derived_refreshes_total', object=view_name, outcome='refreshed')
+    return True
+
+
+def refresh_due():
+    """Refreshes every derived object whose interval or change threshold is reached."""
+    for status in get_status():
+        if not status["due"]:
+            continue
+        try:
+            refresh(status["name"], if_due=True)
+        except Exception as e:
+            print(f"Warning: Refresh of derived object {status['name']} failed: {e}")
+
+
+def start_scheduler():
+    global _thread
+    if not SCHEDULER or (_thread is not None and _thread.is_alive()):
+        return
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_scheduler_loop, name="derived-refresh", daemon=True)
+            _thread.start()
+
+
+def _scheduler_loop():
+    while True:
+        try:
+            refresh_due()
+        except Exception as e:
+            print(f"Warning: Derived object scheduler failed: {e}")
+        time.sleep(POLL_INTERVAL)
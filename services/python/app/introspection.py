@@ -1,70 +1,48 @@
-import psycopg2
 import os
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.environ.get('POSTGRES_HOST', 'postgres'),
-        database=os.environ.get('POSTGRES_DB', 'homeserver'),
-        user=os.environ.get('POSTGRES_USER', 'homeserver'),
-        password=os.environ.get('POSTGRES_PASSWORD', 'homeserver_secret')
-    )
+from app import catalog
+from app.db import connection
+
+EXACT_COUNT_TIMEOUT_MS = int(os.environ.get('EXACT_COUNT_TIMEOUT_MS', 10000))
 
 def get_tables():
     """Returns list of table names in the 'app' schema."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT table_name 
-        FROM information_schema.tables 
-        WHERE table_schema = 'app' 
-        AND table_type = 'BASE TABLE';
-    """)
-    tables = [row[0] for row in cur.fetchall()]
-    cur.close()
-    conn.close()
-    return tables
+    return catalog.get_tables()
 
-def get_table_details(table_name):
-    """Returns columns and primary key info for a given table in 'app' schema."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # 1. Get columns basic info
-    cur.execute("""
-        SELECT column_name, data_type, is_nullable, column_default
-        FROM information_schema.columns
-        WHERE table_schema = 'app'
-        AND table_name = %s
-        ORDER BY ordinal_position;
-    """, (table_name,))
-    columns = []
-    for row in cur.fetchall():
-        columns.append({
-            "name": row[0],
-            "type": row[1],
-            "nullable": row[2] == 'YES',
-            "default": row[3],
-            "is_pk": False
-        })
+def get_overview(exact=()):
+    """
+    One entry per object with its catalog statistics (see catalog.get_stats).
+    Tables named in `exact` also get an exact "rows" count.
+    """
+    stats = catalog.get_stats()
+    overview = []
+    for name in sorted(catalog.get_tables()):
+        entry = {"name": name,
+                 "derived": catalog.is_derived(name),
+                 "partitioned": catalog.partition_column(name) is not None}
+        entry.update(stats.get(name, {}))
+        if name in exact:
+            entry["rows"] = count_rows(name)
+        overview.append(entry)
+    return overview
 
-    # 2. Identify Primary Key - More robust query
-    cur.execute("""
-        SELECT kcu.column_name
-        FROM information_schema.table_constraints tc
-        JOIN information_schema.key_column_usage kcu
-          ON tc.constraint_name = kcu.constraint_name
-          AND tc.table_schema = kcu.table_schema
-          AND tc.table_name = kcu.table_name
-        WHERE tc.constraint_type = 'PRIMARY KEY'
-        AND tc.table_schema = 'app'
-        AND tc.table_name = %s;
-    """, (table_name,))
-    pks = {row[0] for row in cur.fetchall()}
+def count_rows(table_name):
+    """Exact row count; scans the table, bounded by EXACT_COUNT_TIMEOUT_MS."""
+    if catalog.get_columns(table_name) is None:
+        raise ValueError("Table does not exist")
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SET LOCAL statement_timeout = %s", (EXACT_COUNT_TIMEOUT_MS,))
+        cur.execute(f'SELECT count(*) FROM app."{table_name}"')
+        count = cur.fetchone()[0]
+        cur.execute("RESET statement_timeout")
+        cur.close()
+    return count
 
-    for col in columns:
-        if col["name"] in pks:
-            col["is_pk"] = True
+def get_table_details(table_name):
+    """Returns columns and primary key info for a given table in 'app' schema."""
+    return catalog.get_columns(table_name) or []
 
-    cur.close()
-    conn.close()
-    return columns
+def get_primary_key(columns):
+    """Returns the primary key column name from a get_table_details() result."""
+    return next((c['name'] for c in columns if c['is_pk']), None)
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app import ddl, llm, llm_cache
+from app.db import connection, release_request_connection, transaction
+
+# Background object-creation jobs: a prompt is queued in
+# internal.object_jobs and a bounded thread pool runs generation,
+# validation and DDL. Identical in-flight prompts share one job through a
+# partial unique index on prompt_hash, which also dedupes across workers.
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 20))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 300))
+
+_executor = None
+_lock = threading.Lock()
+_in_flight = 0
+
+JOB_COLUMNS = ['id', 'prompt', 'status', 'sql_text', 'table_name', 'error',
+               'cancel_requested', 'created_at', 'started_at', 'finished_at']
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="object-job")
+    return _executor
+
+
+def _reset_after_fork():
+    global _executor, _lock, _in_flight
+    _executor = None
+    _lock = threading.Lock()
+    _in_flight = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def shutdown(wait=True):
+    """
+    Stops accepting work for this process. Running jobs finish (when
+    `wait`); jobs still queued here are failed later by the JOB_TIMEOUT sweep.
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _job_dict(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    job['id'] = str(job['id'])
+    return job
+
+
+def _parse_id(job_id):
+    try:
+        return str(uuid.UUID(str(job_id)))
+    except ValueError:
+        raise ValueError("Job not found")
+
+
+def submit(prompt):
+    """Queues an object-creation job and returns its id (or the id of an identical in-flight job)."""
+    global _in_flight
+    prompt = (prompt or '').strip()
+    if not prompt:
+        raise ValueError("Prompt is required")
+    prompt_hash = hashlib.sha256(llm_cache.normalize_prompt(prompt).encode()).hexdigest()
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        # Jobs orphaned by a crashed worker would otherwise block dedupe forever.
+        cur.execute("""
+            UPDATE internal.object_jobs
+            SET status = 'failed', error = 'Timed out', finished_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
+            AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (JOB_TIMEOUT,))
+        cur.execute("""
+            INSERT INTO internal.object_jobs (prompt, prompt_hash)
+            VALUES (%s, %s)
+            ON CONFLICT (prompt_hash) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        """, (prompt, prompt_hash))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("""
+                SELECT id FROM internal.object_jobs
+                WHERE prompt_hash = %s AND status IN ('queued', 'running')
+            """, (prompt_hash,))
+            existing = cur.fetchone()
+            cur.close()
+            if existing is None:
+                raise ValueError("Could not queue job, try again")
+            return str(existing[0])
+        cur.close()
+    job_id = str(row[0])
+
+    with _lock:
+        if _in_flight >= JOB_QUEUE_LIMIT:
+            full = True
+        else:
+            full = False
+            _in_flight += 1
+    if full:
+        _finish(job_id, 'failed', error="Job queue is full, try again later")
+        raise ValueError("Job queue is full, try again later")
+
+    # The job row must be committed before a worker can pick it up.
+    release_request_connection()
+    try:
+        _get_executor().submit(_run, job_id)
+    except Exception as e:
+        # e.g. after shutdown. Fail the job so identical prompts no longer
+        # attach to it; it would never run.
+        with _lock:
+            _in_flight -= 1
+        _finish(job_id, 'failed', error=f"Could not start job: {e}")
+        raise ValueError("Could not start job, try again later")
+    return job_id
+
+
+def _finish(job_id, status, **fields):
+    sets = ", ".join([f"{k} = %s" for k in fields])
+    sql = "UPDATE internal.object_jobs SET status = %s, finished_at = CURRENT_TIMESTAMP"
+    if sets:
+        sql += ", " + sets
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(sql + " WHERE id = %s", [status] + list(fields.values()) + [job_id])
+        cur.close()
+
+
+def _run(job_id):
+    global _in_flight
+    try:
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE internal.object_jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'queued'
+                RETURNING prompt
+            """, (job_id,))
+            row = cur.fetchone()
+            cur.close()
+        if row is None:
+            return # Cancelled while queued
+
+        sql = llm.generate_ddl_from_prompt(row[0])
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE internal.object_jobs SET sql_text = %s WHERE id = %s RETURNING cancel_requested",
+                        (sql, job_id))
+            cancel_requested = cur.fetchone()[0]
+            cur.close()
+        if cancel_requested:
+            _finish(job_id, 'cancelled')
+            return
+
+        ddl.execute_ddl(sql)
+        _finish(job_id, 'succeeded', table_name=ddl.table_name_from_ddl(ddl.validate_ddl(sql)))
+    except Exception as e:
+        try:
+            _finish(job_id, 'failed', error=str(e))
+        except Exception as finish_e:
+            print(f"Warning: Failed to record job {job_id} failure: {finish_e}")
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+def get_job(job_id):
+    job_id = _parse_id(job_id)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM internal.object_jobs WHERE id = %s", (job_id,))
+        row = cur.fetchone()
+        cur.close()
+    if row is None:
+        raise ValueError("Job not found")
+    return _job_dict(row)
+
+
+def cancel(job_id):
+    """
+    Cancels a queued job immediately. A running job is flagged and stops
+    before its DDL step; once the DDL has run it can no longer be cancelled.
+    """
+    job_id = _parse_id(job_id)
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE internal.object_jobs
+            SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                finished_at = CASE WHEN status = 'queued' THEN CURRENT_TIMESTAMP ELSE finished_at END,
+                cancel_requested = TRUE
+            WHERE id = %s AND status IN ('queued', 'running')
+        """, (job_id,))
+        cur.close()
+    return get_job(job_id)
+
+
+def list_jobs(limit=50):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM internal.object_jobs "
+                    "ORDER BY created_at DESC LIMIT %s", (limit,))
+        rows = cur.fetchall()
+        cur.close()
+    return [_job_dict(row) for row in rows]
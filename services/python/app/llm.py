@@ -1,6 +1,28 @@
 import os
+import time
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from app import metrics, llm_cache
+
+OPENAI_MODEL = "gpt-4o-mini"
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Shared session so upstream calls reuse pooled TCP/TLS connections.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=int(os.environ.get('LLM_HTTP_POOL_SIZE', 10))))
+
+def _post(provider, url, headers, payload):
+    """POST to an LLM provider, recording call latency and outcome."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = _session.post(url, headers=headers, json=payload, timeout=10)
+        response.raise_for_status()
+        outcome = "ok"
+        return response
+    finally:
+        metrics.record_llm_call(provider, time.perf_counter() - start, outcome)
 
 def generate_ddl_from_prompt(prompt):
     """
@@ -25,6 +47,12 @@ def generate_ddl_from_prompt(prompt):
         );
         """
 
+    model = f"openai:{OPENAI_MODEL}" if api_key.startswith('sk-') else f"gemini:{GEMINI_MODEL}"
+    key = llm_cache.cache_key(model, prompt)
+    cached = llm_cache.lookup(key)
+    if cached:
+        return cached
+
     try:
         if api_key.startswith('sk-'):
             # OpenAI Implementation
@@ -34,19 +62,18 @@ def generate_ddl_from_prompt(prompt):
                 "Content-Type": "application/json"
             }
             payload = {
-                "model": "gpt-4o-mini",
+                "model": OPENAI_MODEL,
                 "messages": [
                     {"role": "system", "content": "You are a PostgreSQL expert. Generate a single CREATE TABLE statement in the 'app' schema. Ensure it has a PRIMARY KEY. Return ONLY the SQL code, no markdown or explanation."},
                     {"role": "user", "content": prompt}
                 ],
                 "temperature": 0
             }
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
-            response.raise_for_status()
+            response = _post("openai", url, headers, payload)
             sql = response.json()['choices'][0]['message']['content'].strip()
         else:
             # Gemini Implementation
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+            url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
             headers = {'Content-Type': 'application/json'}
             payload = {
                 "contents": [{
@@ -58,8 +85,7 @@ def generate_ddl_from_prompt(prompt):
                     "temperature": 0
                 }
             }
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
-            response.raise_for_status()
+            response = _post("gemini", url, headers, payload)
             data = response.json()
             sql = data['candidates'][0]['content']['parts'][0]['text'].strip()
 
@@ -68,7 +94,8 @@ def generate_ddl_from_prompt(prompt):
             sql = sql.split("```sql")[1].split("```")[0].strip()
         elif "```" in sql:
             sql = sql.split("```")[1].split("```")[0].strip()
-            
+
+        llm_cache.store(key, model, prompt, sql)
         return sql
 
     except Exception as e:
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app import ddl, metrics
+from app.db import checkout
+
+# Prompt -> DDL cache for llm.generate_ddl_from_prompt. Entries live in
+# internal.llm_ddl_cache and are fronted by an in-memory LRU; both expire
+# after LLM_CACHE_TTL seconds. Only DDL that passes ddl.validate_ddl is stored.
+
+CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+CACHE_MAX_ROWS = int(os.environ.get('LLM_CACHE_MAX_ROWS', 10000))
+
+_memory = OrderedDict()  # key -> (sql, expires_at)
+_lock = threading.Lock()
+
+metrics.describe('homeserver_llm_cache_total', 'counter', 'Prompt->DDL cache lookups by result.')
+
+
+def normalize_prompt(prompt):
+    return ' '.join((prompt or '').lower().split())
+
+
+def cache_key(model, prompt):
+    """Cache key for a prompt as sent to a specific provider/model."""
+    return hashlib.sha256(f'{model}\n{normalize_prompt(prompt)}'.encode()).hexdigest()
+
+
+def _remember(key, sql):
+    with _lock:
+        _memory[key] = (sql, time.monotonic() + CACHE_TTL)
+        _memory.move_to_end(key)
+        while len(_memory) > CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def lookup(key):
+    """Returns cached DDL for a key, or None."""
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            sql, expires_at = entry
+            if expires_at > time.monotonic():
+                _memory.move_to_end(key)
+                metrics.inc('homeserver_llm_cache_total', result='hit_memory')
+                return sql
+            del _memory[key]
+
+    try:
+        with checkout() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE internal.llm_ddl_cache
+                SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE prompt_hash = %s
+                AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING ddl
+            """, (key, CACHE_TTL))
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        print(f"Warning: LLM cache lookup failed: {e}")
+        row = None
+
+    if row is None:
+        metrics.inc('homeserver_llm_cache_total', result='miss')
+        return None
+    metrics.inc('homeserver_llm_cache_total', result='hit_db')
+    _remember(key, row[0])
+    return row[0]
+
+
+def store(key, model, prompt, sql):
+    """Caches generated DDL if it passes validation."""
+    try:
+        ddl.validate_ddl(sql)
+    except ValueError:
+        return
+
+    _remember(key, sql)
+    try:
+        with checkout() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO internal.llm_ddl_cache (prompt_hash, model, prompt, ddl)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (prompt_hash) DO UPDATE
+                SET ddl = EXCLUDED.ddl, created_at = CURRENT_TIMESTAMP, last_used_at = CURRENT_TIMESTAMP
+            """, (key, model, normalize_prompt(prompt), sql))
+            # Size eviction: keep the most recently used CACHE_MAX_ROWS entries.
+            cur.execute("""
+                DELETE FROM internal.llm_ddl_cache
+                WHERE prompt_hash IN (
+                    SELECT prompt_hash FROM internal.llm_ddl_cache
+                    ORDER BY last_used_at DESC
+                    OFFSET %s
+                )
+                OR created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (CACHE_MAX_ROWS, CACHE_TTL))
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        print(f"Warning: LLM cache store failed: {e}")
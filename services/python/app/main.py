@@ -1,38 +1,176 @@
+import csv
+import io
+import json
 import os
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from app import ddl, introspection, crud, llm
+import time
+from functools import wraps
+import psycopg2
+from psycopg2.extensions import TransactionRollbackError
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
+from app import ddl, catalog, introspection, crud, db, metrics, advisor, versions, jobs, audit, serialize, changes, derived, partitions, prepared
+
+
+class RecordJSONProvider(JSONProvider):
+    """jsonify through app.serialize (orjson when installed, ISO 8601 timestamps)."""
+
+    def dumps(self, obj, **kwargs):
+        return serialize.dumps_str(obj)
+
+    def loads(self, s, **kwargs):
+        return json.loads(s)
+
 
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 
 # --- Lifecycle ---
-with app.app_context():
+# Under gunicorn, init_db runs once in the master (see gunicorn.conf.py)
+# and DB_INIT_ON_IMPORT is set to 0 for the workers.
+if os.environ.get('DB_INIT_ON_IMPORT', '1') != '0':
+    with app.app_context():
+        try:
+            ddl.init_db()
+        except Exception as e:
+            print(f"Warning: Database initialization failed: {e}")
+
+# With read replicas configured, a successful write pins the client to the
+# primary for DB_PRIMARY_PIN seconds, so it reads its own writes. Browsers
+# carry the pin as a cookie; other clients can echo the response header.
+PRIMARY_PIN_COOKIE = 'db_primary_until'
+PRIMARY_PIN_HEADER = 'X-Primary-Until'
+
+def _reads_from_replica():
+    if request.method not in ('GET', 'HEAD') or not db.get_replicas():
+        return False
+    pinned_until = request.cookies.get(PRIMARY_PIN_COOKIE) or request.headers.get(PRIMARY_PIN_HEADER)
     try:
-        ddl.init_db()
-    except Exception as e:
-        print(f"Warning: Database initialization failed: {e}")
+        return float(pinned_until) < time.time()
+    except (TypeError, ValueError):
+        return True
+
+# One connection and transaction per request (see db.begin_unit_of_work).
+@app.before_request
+def begin_unit_of_work():
+    metrics.begin_request()
+    db.begin_unit_of_work(read_only=_reads_from_replica())
+    changes.start_purger()
+    derived.start_scheduler()
+    partitions.start_manager()
+
+@app.after_request
+def pin_to_primary(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and db.get_replicas():
+        pinned_until = f"{time.time() + db.PRIMARY_PIN:.3f}"
+        response.headers[PRIMARY_PIN_HEADER] = pinned_until
+        response.set_cookie(PRIMARY_PIN_COOKIE, pinned_until, max_age=int(db.PRIMARY_PIN) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    return metrics.end_request(response)
+
+# Registered last so it runs first: the primary pin and metrics see the
+# outcome of the commit, and a failed commit is never reported as success.
+@app.after_request
+def commit_unit_of_work(response):
+    try:
+        db.commit_unit_of_work()
+    except psycopg2.Error as e:
+        print(f"Error: Request commit failed: {e}")
+        # A serialization failure or deadlock can simply be retried.
+        status = 503 if isinstance(e, TransactionRollbackError) else 500
+        return make_response(jsonify({"error": "The changes could not be committed"}), status)
+    return response
+
+@app.teardown_request
+def end_unit_of_work(exc):
+    db.end_unit_of_work(exc)
+
+def conditional_get(view):
+    """
+    Serves reads of a table conditionally on its change version: an
+    unchanged table answers If-None-Match with 304, and successful responses
+    are kept in the optional in-process response cache.
+    """
+    @wraps(view)
+    def wrapper(table, *args, **kwargs):
+        version = versions.get_version(table)
+        if version is None:
+            return view(table, *args, **kwargs)
+
+        etag = versions.compute_etag(table, version, request.path, request.args)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        cached = versions.cache_get(etag)
+        if cached is not None:
+            _, _, body, status, headers = cached
+            response = Response(body, status=status, headers=headers)
+        else:
+            response = make_response(view(table, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+            versions.cache_put(etag, table, version, response.get_data(),
+                               response.status_code, dict(response.headers))
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
 
 # --- UI Routes ---
 
+def _exact_arg():
+    """Tables named in `exact=a,b` get exact row counts in overviews."""
+    return {t.strip() for t in request.args.get('exact', '').split(',') if t.strip()}
+
 @app.route('/')
 def index():
-    tables = introspection.get_tables()
-    return render_template('list_objects.html', tables=tables)
+    try:
+        objects = introspection.get_overview(exact=_exact_arg())
+        error = None
+    except Exception as e:
+        # e.g. an exact count that hit EXACT_COUNT_TIMEOUT_MS
+        objects = introspection.get_overview()
+        error = f"Exact count failed: {e}"
+    return render_template('list_objects.html', objects=objects, error=error)
 
 @app.route('/create-object', methods=['GET', 'POST'])
 def create_object_ui():
     error = None
     if request.method == 'POST':
         prompt = request.form.get('prompt')
-        sql = llm.generate_ddl_from_prompt(prompt)
         try:
-            ddl.execute_ddl(sql)
-            return redirect(url_for('index'))
+            # Generation and DDL run in the background; the job page polls for the result.
+            job_id = jobs.submit(prompt)
+            return redirect(url_for('job_status_ui', job_id=job_id))
         except Exception as e:
-            error = f"DDL Execution Failed: {str(e)}"
+            error = f"Could not start object creation: {str(e)}"
     
-    return render_template('create_object.html', error=error)
+    return render_template('create_object.html', error=error, recent_jobs=jobs.list_jobs(limit=10))
+
+@app.route('/jobs/<job_id>')
+def job_status_ui(job_id):
+    try:
+        job = jobs.get_job(job_id)
+    except Exception as e:
+        return f"Error: {e}", 404
+    return render_template('job_status.html', job=job)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_ui(job_id):
+    try:
+        jobs.cancel(job_id)
+        return redirect(url_for('job_status_ui', job_id=job_id))
+    except Exception as e:
+        return f"Error: {e}", 400
 
 @app.route('/object/<table>')
+@conditional_get
 def view_object_ui(table):
     try:
         columns = introspection.get_table_details(table)
@@ -46,14 +184,40 @@ def view_object_ui(table):
             if key.startswith('f_'):
                 filters[key[2:]] = value
         
-        rows = crud.list_records(table, filters=filters, sort_by=sort_by, order=order)
+        query = request.args.get('q', '').strip()
+        snippets = None
+        if query:
+            # Search results are ordered by rank rather than by a column.
+            page = crud.search_records(table, query, filters=filters,
+                                       limit=request.args.get('limit', type=int),
+                                       after=request.args.get('after'))
+            page['rows'] = [tuple(r['record'][c['name']] for c in columns) for r in page['results']]
+            page['total_estimate'] = None
+            snippets = [r['snippet'] for r in page['results']]
+        else:
+            page = crud.list_records_page(table, filters=filters, sort_by=sort_by, order=order,
+                                          limit=request.args.get('limit', type=int),
+                                          after=request.args.get('after'),
+                                          estimate_total=True)
+
+        args = request.args.to_dict()
+        args.pop('after', None)
+        first_url = url_for('view_object_ui', table=table, **args) if request.args.get('after') else None
+        next_url = url_for('view_object_ui', table=table, after=page['next'], **args) if page['next'] else None
+
         return render_template('view_object.html', 
                                table_name=table, 
+                               read_only=catalog.is_derived(table),
                                columns=columns, 
-                               rows=rows, 
+                               rows=page['rows'], 
                                current_sort=sort_by, 
                                current_order=order,
-                               current_filters=filters)
+                               current_filters=filters,
+                               current_query=query,
+                               snippets=snippets,
+                               total_estimate=page['total_estimate'],
+                               first_url=first_url,
+                               next_url=next_url)
     except Exception as e:
         return f"Error: {e}", 404
 
@@ -99,7 +263,7 @@ def delete_record_ui(table, id):
 @app.route('/object/<table>/duplicate/<id>', methods=['POST'])
 def duplicate_record_ui(table, id):
     try:
-        crud.duplicate_record(table, id)
+        crud.duplicate_record(table, id, count=request.form.get('count', 1))
         return redirect(url_for('view_object_ui', table=table))
     except Exception as e:
         return f"Error: {e}", 400
@@ -108,7 +272,23 @@ def duplicate_record_ui(table, id):
 
 @app.route('/api/objects', methods=['GET'])
 def api_list_objects():
-    return jsonify(introspection.get_tables())
+    if request.args.get('stats') != '1':
+        return jsonify(introspection.get_tables())
+    try:
+        return jsonify(introspection.get_overview(exact=_exact_arg()))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/stats', methods=['GET'])
+def api_object_stats(table):
+    try:
+        overview = introspection.get_overview(exact={table} if request.args.get('exact') == '1' else ())
+        entry = next((o for o in overview if o["name"] == table), None)
+        if entry is None:
+            return jsonify({"error": "Table not found"}), 404
+        return jsonify(entry)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/api/objects/<table>', methods=['GET'])
 def api_object_details(table):
@@ -117,24 +297,157 @@ def api_object_details(table):
     except:
         return jsonify({"error": "Table not found"}), 404
 
+def _fields_arg():
+    """The `fields=a,b` projection of a records request, or None for all columns."""
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    return list(dict.fromkeys(fields)) or None
+
 @app.route('/api/objects/<table>/records', methods=['GET'])
+@conditional_get
 def api_list_records(table):
     try:
         sort_by = request.args.get('sort')
         order = request.args.get('order', 'ASC')
         filters = {k[2:]: v for k, v in request.args.items() if k.startswith('f_')}
         
-        rows = crud.list_records(table, filters=filters, sort_by=sort_by, order=order)
-        return jsonify(rows)
+        page = crud.list_records_page(table, filters=filters, sort_by=sort_by, order=order,
+                                      limit=request.args.get('limit', type=int),
+                                      after=request.args.get('after'),
+                                      estimate_total=request.args.get('count') == 'estimate',
+                                      fields=_fields_arg())
+
+        # The body is a list of rows (or keyed objects with shape=objects);
+        # paging metadata travels in headers.
+        if request.args.get('shape') == 'objects':
+            response = jsonify([dict(zip(page['columns'], row)) for row in page['rows']])
+        else:
+            response = jsonify(page['rows'])
+        if page['next']:
+            args = request.args.to_dict()
+            args['after'] = page['next']
+            response.headers['X-Next-Cursor'] = page['next']
+            response.headers['Link'] = f'<{url_for("api_list_records", table=table, **args)}>; rel="next"'
+        if page['total_estimate'] is not None:
+            response.headers['X-Total-Estimate'] = str(page['total_estimate'])
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/search', methods=['GET'])
+@conditional_get
+def api_search_records(table):
+    try:
+        filters = {k[2:]: v for k, v in request.args.items() if k.startswith('f_')}
+        page = crud.search_records(table, request.args.get('q'), filters=filters,
+                                   limit=request.args.get('limit', type=int),
+                                   after=request.args.get('after'))
+
+        response = jsonify(page['results'])
+        if page['next']:
+            args = request.args.to_dict()
+            args['after'] = page['next']
+            response.headers['X-Next-Cursor'] = page['next']
+            response.headers['Link'] = f'<{url_for("api_search_records", table=table, **args)}>; rel="next"'
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/aggregate', methods=['GET'])
+@conditional_get
+def api_aggregate_records(table):
+    try:
+        filters = {k[2:]: v for k, v in request.args.items() if k.startswith('f_')}
+        split = lambda name: [v.strip() for v in request.args.get(name, '').split(',') if v.strip()]
+        return jsonify(crud.aggregate_records(table,
+                                              group_by=split('group_by'),
+                                              metrics=split('metrics') or None,
+                                              bucket=request.args.get('bucket'),
+                                              filters=filters,
+                                              limit=request.args.get('limit', type=int)))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route('/api/objects/<table>/export', methods=['GET'])
+def api_export_records(table):
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        sort_by = request.args.get('sort')
+        order = request.args.get('order', 'ASC')
+        filters = {k[2:]: v for k, v in request.args.items() if k.startswith('f_')}
+
+        chunks = crud.export_records(table, filters=filters, sort_by=sort_by, order=order, fmt=fmt,
+                                     fields=_fields_arg())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(stream_with_context(chunks),
+                    mimetype=crud.EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'})
+
 @app.route('/api/objects/<table>/records', methods=['POST'])
 def api_create_record(table):
     try:
         data = request.json
-        crud.create_record(table, data)
-        return jsonify({"status": "success"}), 201
+        record = crud.create_record(table, data)
+        return jsonify({"status": "success", "record": record}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+def _read_bulk_records():
+    """Parses a JSON array, NDJSON or CSV request body into a list of records."""
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None) # Rejected by crud with its line index
+        return records
+    if request.mimetype == 'text/csv':
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        return [{k: (v if v != '' else None) for k, v in row.items()} for row in reader]
+
+    records = request.get_json()
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of records")
+    return records
+
+@app.route('/api/objects/<table>/records/bulk', methods=['POST'])
+def api_bulk_insert(table):
+    try:
+        if request.mimetype == 'text/csv':
+            # Stream CSV uploads straight into COPY FROM STDIN.
+            return jsonify(crud.copy_records(table, request.stream))
+        return jsonify(crud.bulk_insert(table, _read_bulk_records()))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/records/bulk', methods=['PUT'])
+def api_bulk_upsert(table):
+    try:
+        return jsonify(crud.bulk_upsert(table, _read_bulk_records()))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/records/bulk', methods=['DELETE'])
+def api_bulk_delete(table):
+    try:
+        data = request.json
+        ids = data.get('ids') if isinstance(data, dict) else data
+        return jsonify(crud.bulk_delete(table, ids))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/records/<id>', methods=['GET'])
+def api_get_record(table, id):
+    try:
+        fields = _fields_arg()
+        row = crud.get_record(table, id, fields=fields)
+        if row is None:
+            return jsonify({"error": "Record not found"}), 404
+        return jsonify(dict(zip(fields or [c['name'] for c in introspection.get_table_details(table)], row)))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -142,8 +455,10 @@ def api_create_record(table):
 def api_update_record(table, id):
     try:
         data = request.json
-        crud.update_record(table, id, data)
-        return jsonify({"status": "success"})
+        record = crud.update_record(table, id, data)
+        if record is None:
+            return jsonify({"error": "Record not found"}), 404
+        return jsonify({"status": "success", "record": record})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -158,14 +473,218 @@ def api_delete_record(table, id):
 @app.route('/api/objects/<table>/records/<id>/duplicate', methods=['POST'])
 def api_duplicate_record(table, id):
     try:
-        crud.duplicate_record(table, id)
+        count = request.args.get('count') or (request.get_json(silent=True) or {}).get('count', 1)
+        records = crud.duplicate_record(table, id, count=count)
+        return jsonify({"status": "success", "records": records})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/records/<id>/history', methods=['GET'])
+def api_record_history(table, id):
+    try:
+        return jsonify(audit.get_history(table, id, limit=request.args.get('limit', 100, type=int)))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/changes', methods=['GET'])
+def api_record_changes(table):
+    """
+    Server-Sent Events stream of committed inserts, updates and deletes.
+    Reconnecting clients send Last-Event-ID (or ?after=) to resume.
+    """
+    try:
+        frames = changes.stream(table,
+                                last_event_id=request.headers.get('Last-Event-ID') or request.args.get('after'),
+                                include_rows=request.args.get('rows') == '1')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    # The stream stays open indefinitely and reads through pool checkouts.
+    db.release_request_connection()
+    return Response(stream_with_context(frames), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/objects/<table>/partitions', methods=['GET'])
+def api_partitions(table):
+    try:
+        return jsonify(partitions.get_status(table))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/derived', methods=['GET'])
+def api_list_derived():
+    return jsonify(derived.get_status())
+
+@app.route('/api/derived/<name>', methods=['GET'])
+def api_derived_status(name):
+    status = derived.get_status(name)
+    if not status:
+        return jsonify({"error": "Derived object not found"}), 404
+    return jsonify(status[0])
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    try:
+        prompt = (request.json or {}).get('prompt')
+        job_id = jobs.submit(prompt)
+        return jsonify(jobs.get_job(job_id)), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/jobs', methods=['GET'])
+def api_list_jobs():
+    return jsonify(jobs.list_jobs(limit=request.args.get('limit', 50, type=int)))
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_get_job(job_id):
+    try:
+        return jsonify(jobs.get_job(job_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    try:
+        return jsonify(jobs.cancel(job_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+def require_admin(view):
+    """Guards admin endpoints with the ADMIN_TOKEN shared secret (X-Admin-Token header)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.environ.get('ADMIN_TOKEN')
+        if not token or request.headers.get('X-Admin-Token') != token:
+            return jsonify({"error": "Admin token required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/objects/<table>/indexes', methods=['GET'])
+@require_admin
+def api_index_advice(table):
+    try:
+        return jsonify(advisor.get_index_advice(table))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/indexes', methods=['POST'])
+@require_admin
+def api_create_index(table):
+    try:
+        columns = (request.json or {}).get('columns') or []
+        name = advisor.create_index(table, columns)
+        return jsonify({"status": "success", "index": name}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/search', methods=['POST'])
+@require_admin
+def api_rebuild_search(table):
+    try:
+        installed = ddl.rebuild_search(table)
+        return jsonify({"status": "success", "search": installed})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/indexes/<name>', methods=['DELETE'])
+@require_admin
+def api_drop_index(table, name):
+    try:
+        advisor.drop_index(table, name)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route('/api/objects/<table>/partitions', methods=['PUT'])
+@require_admin
+def api_set_partition_policy(table):
+    try:
+        data = request.get_json(silent=True) or {}
+        return jsonify(partitions.set_policy(table,
+                                             premake=data.get('premake'),
+                                             retention=data.get('retention'),
+                                             retention_action=data.get('retention_action'),
+                                             clear_retention='retention' in data and data['retention'] is None))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/partitions/maintain', methods=['POST'])
+@require_admin
+def api_maintain_partitions(table):
+    try:
+        return jsonify(partitions.maintain(table)[table])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/changes', methods=['PUT'])
+@require_admin
+def api_enable_change_feed(table):
+    try:
+        changes.enable(table)
+        return jsonify({"status": "success", "change_feed": True})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/objects/<table>/changes', methods=['DELETE'])
+@require_admin
+def api_disable_change_feed(table):
+    try:
+        changes.disable(table)
+        return jsonify({"status": "success", "change_feed": False})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/derived', methods=['POST'])
+@require_admin
+def api_create_derived():
+    try:
+        data = request.get_json(silent=True) or {}
+        name = ddl.execute_view_ddl(data.get('sql', ''), data.get('key'),
+                                    refresh_interval=data.get('refresh_interval'),
+                                    change_threshold=data.get('change_threshold'))
+        return jsonify(derived.get_status(name)[0]), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/derived/<name>/refresh', methods=['POST'])
+@require_admin
+def api_refresh_derived(name):
+    try:
+        return jsonify({"status": "success", "refreshed": derived.refresh(name)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/derived/<name>', methods=['DELETE'])
+@require_admin
+def api_drop_derived(name):
+    try:
+        ddl.drop_view(name)
+        return jsonify({"status": "success"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/metrics')
+def metrics_endpoint():
+    for key, value in (db.pool_stats() or {}).items():
+        metrics.set_gauge(f'homeserver_db_pool_{key}', value)
+    try:
+        for status in derived.get_status():
+            if status["age_seconds"] is not None:
+                metrics.set_gauge('homeserver_derived_age_seconds', status["age_seconds"], object=status["name"])
+            metrics.set_gauge('homeserver_derived_pending_changes', status["pending_changes"], object=status["name"])
+    except Exception as e:
+        print(f"Warning: Derived object status unavailable: {e}")
+    for replica in db.replica_stats() or ():
+        metrics.set_gauge('homeserver_db_replica_healthy', int(replica["healthy"]), replica=replica["name"])
+        if replica["lag"] is not None:
+            metrics.set_gauge('homeserver_db_replica_lag_seconds', replica["lag"], replica=replica["name"])
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "healthy"})
+    return jsonify({"status": "healthy", "pool": db.pool_stats(), "replicas": db.replica_stats(),
+                    "prepared": prepared.stats()})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Minimal in-process metrics registry rendered in the Prometheus text
+# exposition format. Values are per process.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_meta = {}
+
+
+def describe(name, kind, help_text):
+    _meta[name] = (kind, help_text)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (extra or [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def render():
+    """Returns all metrics in Prometheus text format."""
+    lines = []
+    seen = set()
+
+    def header(name, default_kind):
+        if name in seen:
+            return
+        seen.add(name)
+        kind, help_text = _meta.get(name, (default_kind, ''))
+        if help_text:
+            lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), value in sorted(_gauges.items()):
+            header(name, 'gauge')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), hist in sorted(_histograms.items()):
+            header(name, 'histogram')
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {hist["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {hist["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+describe('homeserver_http_requests_total', 'counter', 'HTTP requests by route, method and status.')
+describe('homeserver_http_request_seconds', 'histogram', 'HTTP request latency by route.')
+describe('homeserver_http_request_db_queries', 'histogram', 'Database queries issued per HTTP request.')
+describe('homeserver_db_queries_total', 'counter', 'Database queries by route and table.')
+describe('homeserver_db_rows_total', 'counter', 'Rows returned or affected by route and table.')
+describe('homeserver_db_query_seconds', 'histogram', 'Database query latency by route and table.')
+describe('homeserver_db_slow_queries_total', 'counter', 'Queries slower than SLOW_QUERY_MS.')
+describe('homeserver_db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled connection.')
+describe('homeserver_db_replica_healthy', 'gauge', 'Whether a read replica is in rotation.')
+describe('homeserver_db_replica_lag_seconds', 'gauge', 'Replay lag of a read replica at its last check.')
+describe('homeserver_llm_request_seconds', 'histogram', 'LLM call latency by provider and outcome.')
+
+
+# --- Per-request accounting ---
+
+def request_labels():
+    """
+    Route template and table for the current request, if any. Table names
+    come from the URL, so any the catalog doesn't know are labelled "other"
+    to keep the number of series bounded.
+    """
+    # catalog imports app.db, which imports this module.
+    from app import catalog
+
+    if not has_request_context():
+        return {"route": "none", "table": ""}
+    rule = request.url_rule
+    table = (request.view_args or {}).get('table', '')
+    if table and not catalog.is_known(table):
+        table = 'other'
+    return {
+        "route": rule.rule if rule else "unmatched",
+        "table": table,
+    }
+
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    stats = g.get('request_stats')
+    if stats is None:
+        stats = g.request_stats = {"queries": 0, "rows": 0, "db": 0.0, "pool_wait": 0.0, "llm": 0.0}
+    return stats
+
+
+def begin_request():
+    g.request_started = time.perf_counter()
+    g.request_stats = None
+
+
+def end_request(response):
+    """Records HTTP metrics and, if enabled, adds a Server-Timing header."""
+    labels = request_labels()
+    started = g.get('request_started')
+    elapsed = time.perf_counter() - started if started else 0.0
+    stats = _request_stats()
+
+    inc('homeserver_http_requests_total', route=labels["route"], method=request.method,
+        status=response.status_code)
+    observe('homeserver_http_request_seconds', elapsed, route=labels["route"])
+    observe('homeserver_http_request_db_queries', stats["queries"], buckets=COUNT_BUCKETS,
+            route=labels["route"])
+
+    if SERVER_TIMING:
+        parts = [
+            f'db;dur={stats["db"] * 1000:.2f};desc="{stats["queries"]} queries, {stats["rows"]} rows"',
+            f'pool;dur={stats["pool_wait"] * 1000:.2f}',
+        ]
+        if stats["llm"]:
+            parts.append(f'llm;dur={stats["llm"] * 1000:.2f}')
+        parts.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def record_query(query, duration, rows):
+    labels = request_labels()
+    inc('homeserver_db_queries_total', **labels)
+    inc('homeserver_db_rows_total', max(rows, 0), **labels)
+    observe('homeserver_db_query_seconds', duration, **labels)
+
+    stats = _request_stats()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["rows"] += max(rows, 0)
+        stats["db"] += duration
+
+    if SLOW_QUERY_MS and duration * 1000 >= SLOW_QUERY_MS:
+        inc('homeserver_db_slow_queries_total', **labels)
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        text = ' '.join(str(query).split())[:1000]
+        print(f"Slow query ({duration * 1000:.1f} ms, route={labels['route']}): {text}")
+
+
+def record_pool_wait(duration):
+    observe('homeserver_db_pool_wait_seconds', duration)
+    stats = _request_stats()
+    if stats is not None:
+        stats["pool_wait"] += duration
+
+
+def record_llm_call(provider, duration, outcome):
+    observe('homeserver_llm_request_seconds', duration, provider=provider, outcome=outcome)
+    stats = _request_stats()
+    if stats is not None:
+        stats["llm"] += duration
@@ -0,0 +1,132 @@
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from app.db import connect_direct
+
+# One LISTEN connection per process, fanned out to in-process subscribers.
+# Callbacks receive the notification payload, or None once the connection
+# is (re)established to signal that notifications may have been missed
+# before it. subscribe() wakes the listener through a pipe, so a new
+# channel is listened on right away; wait_listening() blocks until it is.
+_handlers = {}
+_lock = threading.Lock()
+_listened = threading.Condition(_lock)
+_thread = None
+_pending_channels = set()
+_active_channels = set()
+_wakeup = None  # (read fd, write fd)
+
+RECONNECT_DELAY = 5
+POLL_INTERVAL = 5
+
+
+def subscribe(channel, callback):
+    """Registers a callback for a NOTIFY channel, starting the listener if needed."""
+    global _thread, _wakeup
+    with _lock:
+        _handlers.setdefault(channel, []).append(callback)
+        _pending_channels.add(channel)
+        if _wakeup is None:
+            _wakeup = os.pipe()
+            os.set_blocking(_wakeup[1], False)
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="pg-listener", daemon=True)
+            _thread.start()
+        wakeup = _wakeup[1]
+    try:
+        os.write(wakeup, b'x')
+    except BlockingIOError:
+        pass  # A wakeup is already pending.
+
+
+def wait_listening(channel, timeout):
+    """Blocks until LISTEN on `channel` is active. Returns False after `timeout` seconds."""
+    with _listened:
+        return _listened.wait_for(lambda: channel in _active_channels, timeout)
+
+
+def _reset_after_fork():
+    # The listener thread does not survive a fork; subscribers register
+    # again in the child (see catalog._reset_after_fork).
+    global _lock, _listened, _thread, _wakeup
+    _handlers.clear()
+    _pending_channels.clear()
+    _active_channels.clear()
+    _lock = threading.Lock()
+    _listened = threading.Condition(_lock)
+    _thread = None
+    if _wakeup is not None:
+        for fd in _wakeup:
+            os.close(fd)
+        _wakeup = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _dispatch(channel, payload):
+    with _lock:
+        callbacks = list(_handlers.get(channel, []))
+    for callback in callbacks:
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"Warning: LISTEN handler for '{channel}' failed: {e}")
+
+
+def _listen_pending(cur):
+    with _lock:
+        channels = list(_pending_channels)
+        _pending_channels.clear()
+    for channel in channels:
+        # The connection is in autocommit, so LISTEN is active once this returns.
+        cur.execute(f'LISTEN "{channel}"')
+    if channels:
+        with _listened:
+            _active_channels.update(channels)
+            _listened.notify_all()
+
+
+def _run():
+    with _lock:
+        wakeup = _wakeup[0]
+    while True:
+        conn = None
+        try:
+            conn = connect_direct()
+            cur = conn.cursor()
+            with _lock:
+                _pending_channels.update(_handlers.keys())
+                channels = list(_handlers.keys())
+            _listen_pending(cur)
+            # Anything sent before LISTEN was active (at startup or while
+            # reconnecting) is lost.
+            for channel in channels:
+                _dispatch(channel, None)
+
+            while True:
+                _listen_pending(cur)
+                readable, _, _ = select.select([conn, wakeup], [], [], POLL_INTERVAL)
+                if wakeup in readable:
+                    os.read(wakeup, 512)
+                if conn not in readable:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    _dispatch(note.channel, note.payload)
+        except (psycopg2.Error, OSError) as e:
+            print(f"Warning: LISTEN connection lost, reconnecting: {e}")
+        finally:
+            with _lock:
+                _active_channels.clear()
+            if conn is not None:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+        time.sleep(RECONNECT_DELAY)
@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+
+from app import catalog, metrics
+from app.db import checkout, connection
+
+# Time-partitioned objects: tables created with PARTITION BY RANGE on a
+# date/timestamp column (see ddl.validate_ddl). Each gets one partition per
+# interval ("day", "week", "month" or "year") plus a default partition for
+# rows outside them. A background manager keeps PARTITION_PREMAKE future
+# partitions ahead of time and, with a retention set, detaches expired
+# partitions into the archive schema or drops them. Every worker runs the
+# manager; an advisory lock per table lets only one of them work on it.
+
+INTERVALS = ('day', 'week', 'month', 'year')
+RETENTION_ACTIONS = ('detach', 'drop')
+ARCHIVE_SCHEMA = 'archive'
+
+DEFAULT_INTERVAL = os.environ.get('PARTITION_INTERVAL', 'month')
+DEFAULT_PREMAKE = int(os.environ.get('PARTITION_PREMAKE', 3))
+DEFAULT_RETENTION = os.environ.get('PARTITION_RETENTION') or None
+DEFAULT_RETENTION_ACTION = os.environ.get('PARTITION_RETENTION_ACTION', 'detach')
+MAINTENANCE_INTERVAL = float(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', 3600))
+MAX_PREMAKE = 120
+# Partition DDL locks the parent; give up rather than queue behind long reads.
+LOCK_TIMEOUT = '5s'
+
+if DEFAULT_INTERVAL not in INTERVALS:
+    raise ValueError(f"Invalid PARTITION_INTERVAL '{DEFAULT_INTERVAL}'")
+if DEFAULT_RETENTION_ACTION not in RETENTION_ACTIONS:
+    raise ValueError(f"Invalid PARTITION_RETENTION_ACTION '{DEFAULT_RETENTION_ACTION}'")
+
+_thread = None
+_lock = threading.Lock()
+
+metrics.describe('homeserver_partitions_total', 'counter', 'Partitions created, detached or dropped by the manager.')
+
+POLICY_COLUMNS = "table_name, partition_column, partition_interval, premake, retention::text, " \
+                 "retention_action, last_maintained_at, last_error"
+POLICY_KEYS = ("table", "column", "interval", "premake", "retention", "retention_action",
+               "last_maintained_at", "last_error")
+
+# Upper bound of a range partition, parsed from its FOR VALUES clause.
+PARTITIONS_QUERY = r"""
+    SELECT c.relname,
+           pg_get_expr(c.relpartbound, c.oid),
+           substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \(''([^'']+)''\)')::timestamp,
+           GREATEST(c.reltuples, 0)::bigint
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    ORDER BY 3 NULLS FIRST
+"""
+
+
+def _reset_after_fork():
+    global _thread, _lock
+    _thread = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _partition_name(table_name, start):
+    return f'{table_name[:50]}_p{start:%Y%m%d}'
+
+
+def register(cur, table_name, column):
+    """
+    Records the default policy for a new partitioned table and creates its
+    default and first partitions, in the caller's transaction.
+    """
+    cur.execute("""
+        SELECT format_type(a.atttypid, NULL) FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attname = %s
+    """, (f'app."{table_name}"', column))
+    row = cur.fetchone()
+    if not row or row[0] not in catalog.TEMPORAL_TYPES:
+        raise ValueError("Objects can only be partitioned on a date or timestamp column")
+    # Postgres only enforces (id, partition column) as unique, so records
+    # stay addressable by id alone only if ids are always generated.
+    cur.execute("""
+        SELECT a.atthasdef OR a.attidentity <> ''
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary AND a.attname <> %s
+    """, (f'app."{table_name}"', column))
+    generated = [row[0] for row in cur.fetchall()]
+    if len(generated) != 1 or not generated[0]:
+        raise ValueError("A partitioned object's primary key must be one generated column plus the "
+                         "partition column, e.g. id BIGSERIAL with PRIMARY KEY (id, created_at)")
+    cur.execute("""
+        INSERT INTO internal.partitioned_objects
+            (table_name, partition_column, partition_interval, premake, retention, retention_action)
+        VALUES (%s, %s, %s, %s, %s::interval, %s)
+    """, (table_name, column, DEFAULT_INTERVAL, DEFAULT_PREMAKE, DEFAULT_RETENTION, DEFAULT_RETENTION_ACTION))
+    cur.execute(f'CREATE TABLE app."{table_name[:54]}_default" PARTITION OF app."{table_name}" DEFAULT')
+    create_partitions(cur, table_name, DEFAULT_INTERVAL, DEFAULT_PREMAKE)
+
+
+def create_partitions(cur, table_name, interval, premake):
+    """Creates the partitions from the current interval up to `premake` ahead. Returns their names."""
+    cur.execute("""
+        SELECT b, b + ('1 ' || %(unit)s)::interval
+        FROM generate_series(date_trunc(%(unit)s, LOCALTIMESTAMP),
+                             date_trunc(%(unit)s, LOCALTIMESTAMP) + %(premake)s * ('1 ' || %(unit)s)::interval,
+                             ('1 ' || %(unit)s)::interval) b
+    """, {"unit": interval, "premake": premake})
+    ranges = cur.fetchall()
+    cur.execute(PARTITIONS_QUERY, (f'app."{table_name}"',))
+    existing = {row[0] for row in cur.fetchall()}
+
+    created = []
+    for start, end in ranges:
+        name = _partition_name(table_name, start)
+        if name in existing:
+            continue
+        # Fails if the default partition already holds rows of this range;
+        # the other partitions are still created.
+        cur.execute("SAVEPOINT create_partition")
+        try:
+            cur.execute(f'CREATE TABLE app."{name}" PARTITION OF app."{table_name}" FOR VALUES FROM (%s) TO (%s)',
+                        (start, end))
+            cur.execute("RELEASE SAVEPOINT create_partition")
+            created.append(name)
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+            print(f"Warning: Partition {name} not created: {e}")
+    return created
+
+
+def expire_partitions(cur, table_name, retention, action):
+    """Detaches (into the archive schema) or drops partitions that ended before `retention` ago."""
+    cur.execute(f"""
+        SELECT relname FROM ({PARTITIONS_QUERY}) p (relname, bound, upper_bound, row_estimate)
+        WHERE upper_bound <= LOCALTIMESTAMP - %s::interval
+    """, (f'app."{table_name}"', retention))
+    expired = [row[0] for row in cur.fetchall()]
+    for name in expired:
+        if action == 'drop':
+            cur.execute(f'DROP TABLE app."{name}"')
+        else:
+            cur.execute(f'ALTER TABLE app."{table_name}" DETACH PARTITION app."{name}"')
+            cur.execute(f'ALTER TABLE app."{name}" SET SCHEMA {ARCHIVE_SCHEMA}')
+    return expired
+
+
+def maintain(table_name=None):
+    """
+    Creates upcoming partitions and expires old ones for every partitioned
+    object (or one). Returns {table: {"created": [...], "expired": [...]}};
+    tables another process is maintaining right now are marked "skipped".
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        if table_name is None:
+            cur.execute("SELECT table_name FROM internal.partitioned_objects ORDER BY table_name")
+        else:
+            cur.execute("SELECT table_name FROM internal.partitioned_objects WHERE table_name = %s",
+                        (table_name,))
+        tables = [row[0] for row in cur.fetchall()]
+        cur.close()
+    if table_name is not None and not tables:
+        raise ValueError("Object is not partitioned")
+
+    results = {}
+    for name in tables:
+        try:
+            result = _maintain_table(name)
+        except Exception as e:
+            print(f"Warning: Partition maintenance of {name} failed: {e}")
+            result = {"error": str(e)}
+        results[name] = result if result is not None else {"skipped": True}
+    return results
+
+
+def _maintain_table(table_name):
+    with checkout() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('partitions:' || %s))", (table_name,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return None
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            cur.execute("""
+                SELECT partition_interval, premake, retention, retention_action
+                FROM internal.partitioned_objects WHERE table_name = %s
+            """, (table_name,))
+            interval, premake, retention, action = cur.fetchone()
+            created = create_partitions(cur, table_name, interval, premake)
+            expired = expire_partitions(cur, table_name, retention, action) if retention is not None else []
+            cur.execute("""
+                UPDATE internal.partitioned_objects
+                SET last_maintained_at = CURRENT_TIMESTAMP, last_error = NULL
+                WHERE table_name = %s
+            """, (table_name,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            try:
+                cur.execute("UPDATE internal.partitioned_objects SET last_error = %s WHERE table_name = %s",
+                            (str(e), table_name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+            raise
+        finally:
+            cur.close()
+    if created:
+        metrics.inc('homeserver_partitions_total', len(created), action='created')
+    if expired:
+        metrics.inc('homeserver_partitions_total', len(expired), action='detached' if action == 'detach' else 'dropped')
+    return {"created": created, "expired": expired}
+
+
+def set_policy(table_name, premake=None, retention=None, retention_action=None, clear_retention=False):
+    """
+    Updates a partitioned object's policy. The interval is fixed when the
+    object is created. `clear_retention` keeps partitions forever.
+    """
+    if premake is not None:
+        premake = int(premake)
+        if not 0 <= premake <= MAX_PREMAKE:
+            raise ValueError(f"premake must be between 0 and {MAX_PREMAKE}")
+    if retention_action is not None and retention_action not in RETENTION_ACTIONS:
+        raise ValueError(f"retention_action must be one of {', '.join(RETENTION_ACTIONS)}")
+    with checkout() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE internal.partitioned_objects
+            SET premake = COALESCE(%s, premake),
+                retention = CASE WHEN %s THEN NULL ELSE COALESCE(%s::interval, retention) END,
+                retention_action = COALESCE(%s, retention_action)
+            WHERE table_name = %s
+        """, (premake, clear_retention, retention, retention_action, table_name))
+        updated = cur.rowcount
+        conn.commit()
+        cur.close()
+    if not updated:
+        raise ValueError("Object is not partitioned")
+    return get_status(table_name)
+
+
+def get_status(table_name):
+    """A partitioned object's policy and its partitions, oldest first."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {POLICY_COLUMNS} FROM internal.partitioned_objects WHERE table_name = %s",
+                    (table_name,))
+        row = cur.fetchone()
+        if row is None:
+            cur.close()
+            raise ValueError("Object is not partitioned")
+        cur.execute(PARTITIONS_QUERY, (f'app."{table_name}"',))
+        partitions = [{"name": name, "bound": bound, "rows_estimate": rows}
+                      for name, bound, _, rows in cur.fetchall()]
+        cur.close()
+    status = dict(zip(POLICY_KEYS, row))
+    status["partitions"] = partitions
+    return status
+
+
+def start_manager():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_manager_loop, name="partition-manager", daemon=True)
+            _thread.start()
+
+
+def _manager_loop():
+    while True:
+        try:
+            maintain()
+        except Exception as e:
+            print(f"Warning: Partition maintenance failed: {e}")
+        time.sleep(MAINTENANCE_INTERVAL)
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+import time
+
+import psycopg2.errors
+
+from app import catalog, metrics
+
+# Server-side prepared statements for the generated single-record SQL in
+# crud. A statement is prepared (PREPARE ... AS, with $n parameters) the
+# first time a pooled connection runs it and executed with EXECUTE after
+# that, so Postgres parses and analyzes it once per connection and can
+# switch to a cached generic plan. Each connection keeps its
+# PREPARED_STATEMENTS_MAX most recently used statements and deallocates all
+# of them when the schema catalog changes.
+
+ENABLED = os.environ.get('PREPARED_STATEMENTS', '1') != '0'
+MAX_PER_CONNECTION = int(os.environ.get('PREPARED_STATEMENTS_MAX', 200))
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "prepare_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+metrics.describe('homeserver_prepared_statements_total', 'counter',
+                 'Prepared statement lookups by outcome (hit, miss, evicted).')
+metrics.describe('homeserver_prepared_prepare_seconds', 'histogram',
+                 'Time to PREPARE a statement, the parse and analysis cost later hits skip.')
+
+
+def _reset_after_fork():
+    global _stats_lock
+    _stats_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _count(outcome, n=1, prepare_seconds=0.0):
+    key = {"hit": "hits", "miss": "misses", "evicted": "evictions"}[outcome]
+    with _stats_lock:
+        _stats[key] += n
+        _stats["prepare_seconds"] += prepare_seconds
+    metrics.inc('homeserver_prepared_statements_total', n, outcome=outcome)
+
+
+def _numbered(sql):
+    """`sql` with %s placeholders as $1..$n, or None if it has other % characters."""
+    parts = sql.split('%s')
+    if any('%' in part for part in parts):
+        return None
+    text = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+    return text, len(parts) - 1
+
+
+def execute(cur, sql, params=()):
+    """
+    Runs `sql` (psycopg2 %s placeholders) like cur.execute, as a prepared
+    statement when the connection supports it.
+    """
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared', None)
+    numbered = _numbered(sql) if ENABLED and prepared is not None else None
+    if numbered is None:
+        cur.execute(sql, params)
+        return
+    text, count = numbered
+    name = 'hs_' + hashlib.sha1(sql.encode()).hexdigest()[:24]
+
+    generation = catalog.generation()
+    if conn.prepared_generation != generation:
+        if prepared:
+            cur.execute("DEALLOCATE ALL")
+            _count('evicted', len(prepared))
+            prepared.clear()
+        conn.prepared_generation = generation
+
+    if name in prepared:
+        prepared.move_to_end(name)
+        _count('hit')
+    else:
+        if len(prepared) >= MAX_PER_CONNECTION:
+            oldest, _ = prepared.popitem(last=False)
+            cur.execute(f'DEALLOCATE {oldest}')
+            _count('evicted')
+        started = time.perf_counter()
+        cur.execute(f'PREPARE {name} AS {text}')
+        elapsed = time.perf_counter() - started
+        prepared[name] = None
+        metrics.observe('homeserver_prepared_prepare_seconds', elapsed)
+        _count('miss', prepare_seconds=elapsed)
+
+    args = f' ({", ".join(["%s"] * count)})' if count else ''
+    try:
+        cur.execute(f'EXECUTE {name}{args}', params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The session lost its statements (e.g. DISCARD ALL); start over.
+        prepared.clear()
+        raise
+
+
+def stats():
+    """Hits, misses, evictions and the estimated parse/analysis time hits saved."""
+    with _stats_lock:
+        result = dict(_stats)
+    average = result["prepare_seconds"] / result["misses"] if result["misses"] else 0.0
+    result["estimated_saved_seconds"] = result["hits"] * average
+    return result
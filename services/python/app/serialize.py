@@ -0,0 +1,40 @@
+import base64
+import datetime
+import decimal
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib encoder produces the same output.
+    orjson = None
+
+# JSON encoding for record responses. Timestamps, dates and times are ISO
+# 8601, UUIDs are strings, Decimals are strings (no precision loss), JSON/
+# JSONB values are embedded as-is and bytea is base64. orjson is used when
+# installed and encodes datetime/UUID natively.
+
+
+def _default(o):
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if isinstance(o, datetime.timedelta):
+        return o.total_seconds()
+    if isinstance(o, (bytes, memoryview)):
+        return base64.b64encode(bytes(o)).decode('ascii')
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Encodes obj as UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps_str(obj):
+    return dumps(obj).decode('utf-8')
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from app.db import connection
+
+# Per-table change versions (internal.table_versions, bumped by the
+# homeserver_version trigger) drive conditional GETs: a read response's
+# ETag is derived from the table's version plus the request, so polls of
+# an unchanged table are answered with 304 without touching the table.
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 0))
+
+_cache = OrderedDict()  # etag -> (table, version, body, status, headers)
+_cache_lock = threading.Lock()
+
+
+def get_version(table_name):
+    """Current change version of an app table, or None if it isn't tracked."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT version FROM internal.table_versions WHERE table_name = %s", (table_name,))
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else None
+
+
+def compute_etag(table_name, version, path, args):
+    """ETag for a read of `path` with query `args` at a given table version."""
+    query = '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+    digest = hashlib.sha1(f'{table_name}|{version}|{path}?{query}'.encode()).hexdigest()
+    return f'{table_name}-{version}-{digest[:16]}'
+
+
+def cache_get(etag):
+    if not RESPONSE_CACHE_SIZE:
+        return None
+    with _cache_lock:
+        entry = _cache.get(etag)
+        if entry is not None:
+            _cache.move_to_end(etag)
+        return entry
+
+
+def cache_put(etag, table_name, version, body, status, headers):
+    """Stores a serialized response, dropping older versions of the same table."""
+    if not RESPONSE_CACHE_SIZE:
+        return
+    with _cache_lock:
+        stale = [k for k, v in _cache.items() if v[0] == table_name and v[1] < version]
+        for k in stale:
+            del _cache[k]
+        _cache[etag] = (table_name, version, body, status, headers)
+        while len(_cache) > RESPONSE_CACHE_SIZE:
+            _cache.popitem(last=False)
@@ -0,0 +1,259 @@
+"""
+Load/benchmark harness for the HTTP API and CRUD layer.
+
+Seeds app.bench_* tables through ddl.execute_ddl, then drives the Flask
+routes in-process (no network) with concurrent clients and reports
+throughput, latency percentiles, DB queries per request and peak RSS.
+
+    cd services/python
+    python -m bench.benchmark --rows 10000 --width 8 --clients 8 \
+        --output bench_result.json --baseline bench/baseline.json
+
+Requires the usual POSTGRES_* environment variables pointing at a local
+database. LLM_API_KEY is cleared so object creation uses the mock generator.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+os.environ['LLM_API_KEY'] = ''
+os.environ['SERVER_TIMING'] = '1'
+
+from app import crud, db, ddl, jobs, metrics  # noqa: E402
+from app.main import app  # noqa: E402
+
+TABLE_PREFIX = 'bench_'
+QUERIES_RE = re.compile(r'desc="(\d+) queries')
+
+
+def seed_table(name, rows, width, created):
+    """
+    Creates app.<name> with `width` extra text columns and inserts `rows`
+    rows. The name is added to `created` as soon as the table exists.
+    """
+    extra = ''.join(f', col_{i} TEXT' for i in range(width))
+    ddl.execute_ddl(f"""
+        CREATE TABLE app.{name} (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            name TEXT NOT NULL,
+            category TEXT,
+            amount INTEGER,
+            created_at TIMESTAMP DEFAULT NOW(){extra}
+        );
+    """)
+    created.append(name)
+
+    batch = []
+    for i in range(rows):
+        record = {
+            "name": f"item-{i}",
+            "category": f"cat-{i % 20}",
+            "amount": random.randint(0, 10000),
+        }
+        for c in range(width):
+            record[f"col_{c}"] = uuid.uuid4().hex * 2
+        batch.append(record)
+        if len(batch) == 5000:
+            crud.bulk_insert(name, batch)
+            batch = []
+    if batch:
+        crud.bulk_insert(name, batch)
+
+
+def drop_bench_tables(names):
+    """Drops the tables this run created, and nothing else."""
+    with db.checkout() as conn:
+        cur = conn.cursor()
+        for name in names:
+            cur.execute(f'DROP TABLE IF EXISTS app."{name}" CASCADE')
+        conn.commit()
+        cur.close()
+    from app import catalog
+    catalog.invalidate()
+
+
+def sample_ids(table, count):
+    with db.checkout() as conn:
+        cur = conn.cursor()
+        cur.execute(f'SELECT id::text FROM app."{table}" ORDER BY random() LIMIT %s', (count,))
+        ids = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return ids
+
+
+def build_scenarios(table, ids):
+    """Each scenario maps to a function(client, i) that issues one request."""
+    def pick(i):
+        return ids[i % len(ids)]
+
+    return {
+        "list": lambda c, i: c.get(f'/api/objects/{table}/records?limit=100'),
+        "list_filter": lambda c, i: c.get(f'/api/objects/{table}/records?f_category=cat-{i % 20}&limit=100'),
+        "list_sort": lambda c, i: c.get(f'/api/objects/{table}/records?sort=amount&order=DESC&limit=100'),
+        "view_ui": lambda c, i: c.get(f'/object/{table}'),
+        "create": lambda c, i: c.post(f'/api/objects/{table}/records',
+                                      json={"name": f"new-{i}", "category": "cat-new", "amount": i}),
+        "update": lambda c, i: c.put(f'/api/objects/{table}/records/{pick(i)}',
+                                     json={"amount": i}),
+        "duplicate": lambda c, i: c.post(f'/api/objects/{table}/records/{pick(i)}/duplicate'),
+        "delete": lambda c, i: c.delete(f'/api/objects/{table}/records/{ids.pop() if ids else uuid.uuid4()}'),
+    }
+
+
+def run_scenario(request_fn, total, clients):
+    latencies = []
+    queries = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            response = request_fn(client, i)
+            elapsed = time.perf_counter() - start
+            match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+            with lock:
+                latencies.append(elapsed)
+                if match:
+                    queries.append(int(match.group(1)))
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "db_queries_per_request": round(statistics.mean(queries), 2) if queries else None,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns a list of human-readable regressions against a baseline result."""
+    regressions = []
+    for name, current in result["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} < {base['throughput_rps']} rps")
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} > {base['p95_ms']} ms")
+        if (current["db_queries_per_request"] is not None and base.get("db_queries_per_request") is not None
+                and current["db_queries_per_request"] > base["db_queries_per_request"]):
+            regressions.append(f"{name}: {current['db_queries_per_request']} queries/request "
+                               f"> {base['db_queries_per_request']}")
+    base_rss = baseline.get("peak_rss_mb")
+    if base_rss and result["peak_rss_mb"] > base_rss * (1 + tolerance):
+        regressions.append(f"peak RSS {result['peak_rss_mb']} > {base_rss} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000, help='rows seeded into the bench table')
+    parser.add_argument('--width', type=int, default=4, help='extra TEXT columns on the bench table')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--scenarios', default='', help='comma-separated subset of scenarios')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--baseline', help='compare against a stored JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--keep', action='store_true', help='keep the bench tables afterwards')
+    args = parser.parse_args(argv)
+
+    metrics.SERVER_TIMING = True
+    random.seed(42)
+    table = f'{TABLE_PREFIX}{args.rows}_{args.width}'
+
+    # A table left by --keep makes seeding fail rather than being dropped:
+    # only tables created by this run are ever removed.
+    created = []
+    try:
+        seed_start = time.perf_counter()
+        seed_table(table, args.rows, args.width, created)
+        seed_seconds = time.perf_counter() - seed_start
+
+        # Exercise the "New Object" route once with the mock LLM and wait
+        # for its background job, so cleanup doesn't race the table creation.
+        response = app.test_client().post('/create-object', data={"prompt": f"Create a {TABLE_PREFIX}mock table"})
+        job_id = response.headers.get('Location', '').rstrip('/').rsplit('/', 1)[-1]
+        deadline = time.monotonic() + 30
+        while job_id and time.monotonic() < deadline:
+            job = jobs.get_job(job_id)
+            if job['status'] not in ('queued', 'running'):
+                if job['status'] == 'succeeded':
+                    created.append(job['table_name'])
+                break
+            time.sleep(0.1)
+
+        ids = sample_ids(table, max(args.requests * 2, 1))
+        scenarios = build_scenarios(table, ids)
+        selected = [s for s in args.scenarios.split(',') if s] or list(scenarios)
+
+        result = {
+            "meta": {
+                "rows": args.rows,
+                "width": args.width,
+                "clients": args.clients,
+                "requests": args.requests,
+                "seed_seconds": round(seed_seconds, 3),
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            "scenarios": {},
+        }
+        for name in selected:
+            result["scenarios"][name] = run_scenario(scenarios[name], args.requests, args.clients)
+            print(f"{name:12} {json.dumps(result['scenarios'][name])}")
+
+        # ru_maxrss is reported in kilobytes on Linux.
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        print(f"peak RSS: {result['peak_rss_mb']} MB")
+    finally:
+        if not args.keep:
+            drop_bench_tables(created)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
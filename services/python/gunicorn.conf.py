@@ -0,0 +1,64 @@
+import os
+
+# gevent must patch before the app is preloaded: module-level locks and
+# queues created earlier stay native and block the whole worker when a
+# greenlet waits on one (e.g. app.catalog's lock across a reload).
+if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    # psycopg2 blocks the whole process under gevent unless patched.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+import multiprocessing  # noqa: E402
+
+# Production server: gunicorn -c gunicorn.conf.py app.main:app
+#
+# The master imports the app once (preload_app), runs init_db once per
+# deployment and closes its connections before forking. Each worker then
+# opens its own connection pool and schema cache (see the
+# os.register_at_fork hooks in app.db and app.catalog) and warms both up
+# before taking traffic. SIGHUP reloads workers gracefully; SIGTERM stops
+# accepting connections and drains in-flight requests for graceful_timeout.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')  # gthread | gevent
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+accesslog = '-'
+
+# Workers must not run init_db again when they import app.main.
+os.environ['DB_INIT_ON_IMPORT'] = '0'
+
+
+def on_starting(server):
+    from app import db, ddl
+    try:
+        ddl.init_db()
+    except Exception as e:
+        server.log.warning(f"Database initialization failed: {e}")
+    finally:
+        db.close_pool()
+
+
+def post_worker_init(worker):
+    from app import catalog, db
+    try:
+        db.get_pool()
+        catalog.get_tables()
+    except Exception as e:
+        worker.log.warning(f"Worker warm-up failed: {e}")
+
+
+def worker_exit(server, worker):
+    from app import audit, db, jobs
+    jobs.shutdown(wait=True)
+    audit.shutdown()
+    db.close_pool()